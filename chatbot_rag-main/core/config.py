@@ -1,5 +1,7 @@
 # core/config.py
 
+import os
+
 # Paths
 PRODUCT_JSON_PATH = "core/data/products/product_catalog.json"
 DOCUMENTS_DIR = "core/data/documents"
@@ -8,6 +10,32 @@ CHROMA_DB_DIR = "data/vectorstore/products"
 # Embedding model
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 
+# In-process embedding backend: "torch" (fp16 on GPU) or "onnx" (ONNX Runtime
+# with the O3-optimized graph; O4 trades away more embedding quality). "onnx"
+# needs the optional optimum[onnxruntime] package and falls back to torch without it
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = "onnx/model_O3.onnx"
+
+# Text Embeddings Inference server (e.g. "http://tei:8080"); when unset the
+# embedding model runs in-process
+TEI_URL = os.getenv("TEI_URL")
+TEI_TIMEOUT = 10.0
+
+# Query caches (entries); embeddings and retrieval results are deterministic
+# for a given index, so these are only bounded, never invalidated
+EMBEDDING_CACHE_SIZE = 4096
+RETRIEVAL_CACHE_SIZE = 4096
+RETRIEVAL_CACHE_LOG_EVERY = 500
+
+# Threads that run retrieval alongside context building; matches the
+# default request threadpool size (40) so retrieval never queues behind it
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "40"))
+
+# Concurrent query embeddings are coalesced into batches of up to this size,
+# waiting at most EMBEDDING_BATCH_WAIT seconds for a batch to fill
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_BATCH_WAIT = 0.005
+
 # Chunking
 CHUNK_SIZE = 300
 CHUNK_OVERLAP = 50
@@ -19,6 +47,14 @@ CHUNK_OVERLAP_QA = CHUNK_OVERLAP
 # ChromaDB collection
 CHROMA_COLLECTION_NAME = "product_data"
 
+# HNSW index parameters, applied when the embedding scripts first create the
+# collection. all-MiniLM-L6-v2 outputs unit vectors, so cosine ranks like l2
+CHROMA_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200
+}
+
 # Token limits (optional for LLMs later)
 LLM_CONTEXT_SIZE = 2048
 
@@ -4,22 +4,350 @@ Email Service Module
 Handles sending emails for password reset and other notifications
 """
 
+import asyncio
+import atexit
+import email
+import email.policy
+import functools
 import smtplib
 import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import Optional
+import string
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import logging
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load environment variables from the parent directory
+# Load environment variables from the parent directory, unless the
+# process manager already provided them
 env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+if 'GMAIL_EMAIL' not in os.environ and env_path.exists():
+    load_dotenv(dotenv_path=env_path)
 
 logger = logging.getLogger(__name__)
 
+# Recycle the cached SMTP session after this many seconds or messages
+SMTP_CONNECTION_MAX_AGE = 300
+SMTP_CONNECTION_MAX_MESSAGES = 1000
+
+# Default send rate per SMTP server; override with SMTP_MAX_PER_SEC
+SMTP_MAX_PER_SEC = 5.0
+
+# Socket timeout (seconds) for SMTP I/O so a stalled server can't wedge a worker
+SMTP_TIMEOUT = 10.0
+
+# Background workers so request handlers don't wait on the SMTP round trip
+EMAIL_SEND_WORKERS = 4
+_send_executor = ThreadPoolExecutor(max_workers=EMAIL_SEND_WORKERS, thread_name_prefix="email-send")
+
+# Concurrent SMTP sessions kept open for the asyncio (aiosmtplib) send path
+AIO_SMTP_POOL_SIZE = 4
+
+# Email bodies; only the greeting name and reset link vary per send
+_RESET_TEXT_TPL = string.Template("""
+Hello ${user_name},
+
+You requested a password reset for your Coffee AI account.
+
+Click the following link to reset your password:
+${reset_url}
+
+This link will expire in 1 hour for security reasons.
+
+If you didn't request this password reset, please ignore this email.
+
+Best regards,
+Coffee AI Team
+""")
+
+_RESET_HTML_TPL = string.Template("""
+<html>
+  <body>
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+      <h2 style="color: #8B4513;">Password Reset - Coffee AI</h2>
+      
+      <p>Hello ${user_name},</p>
+      
+      <p>You requested a password reset for your Coffee AI account.</p>
+      
+      <div style="text-align: center; margin: 30px 0;">
+        <a href="${reset_url}" 
+           style="background-color: #8B4513; color: white; padding: 12px 24px; 
+                  text-decoration: none; border-radius: 5px; display: inline-block;">
+          Reset Password
+        </a>
+      </div>
+      
+      <p style="color: #666; font-size: 14px;">
+        This link will expire in 1 hour for security reasons.
+      </p>
+      
+      <p style="color: #666; font-size: 14px;">
+        If you didn't request this password reset, please ignore this email.
+      </p>
+      
+      <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
+      
+      <p style="color: #999; font-size: 12px;">
+        Best regards,<br>
+        Coffee AI Team
+      </p>
+    </div>
+  </body>
+</html>
+""")
+
+_CONFIRMATION_TEXT_TPL = string.Template("""
+Hello ${user_name},
+
+Your password has been successfully reset for your Coffee AI account.
+
+If you didn't make this change, please contact our support team immediately.
+
+Best regards,
+Coffee AI Team
+""")
+
+_CONFIRMATION_HTML_TPL = string.Template("""
+<html>
+  <body>
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+      <h2 style="color: #8B4513;">Password Reset Successful - Coffee AI</h2>
+      
+      <p>Hello ${user_name},</p>
+      
+      <p>Your password has been successfully reset for your Coffee AI account.</p>
+      
+      <div style="background-color: #d4edda; border: 1px solid #c3e6cb; 
+                  color: #155724; padding: 15px; border-radius: 5px; margin: 20px 0;">
+        <strong>✓ Password Reset Complete</strong><br>
+        You can now log in with your new password.
+      </div>
+      
+      <p style="color: #dc3545; font-weight: bold;">
+        If you didn't make this change, please contact our support team immediately.
+      </p>
+      
+      <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
+      
+      <p style="color: #999; font-size: 12px;">
+        Best regards,<br>
+        Coffee AI Team
+      </p>
+    </div>
+  </body>
+</html>
+""")
+
+# Messages are assembled once at import as raw RFC 5322 bytes with a
+# fixed MIME boundary and placeholders for the per-send values, so a send
+# is only a handful of bytes.replace calls
+_MIME_BOUNDARY = "==CoffeeAI-alternative-7f3a9c2e=="
+
+def _placeholder(key: str) -> str:
+    return f"@@{key.upper()}@@"
+
+def _build_message_skeleton(subject: str, text_tpl: Optional[string.Template], html_tpl: string.Template) -> bytes:
+    """Assemble a message with placeholders for sender, recipient and template fields.
+    Without a text template the message is a single text/html part instead of multipart/alternative."""
+    fields = {key: _placeholder(key) for key in ("user_name", "reset_url")}
+    lines = [
+        f"Subject: {subject}",
+        f"From: {_placeholder('sender')}",
+        f"To: {_placeholder('recipient')}",
+        "MIME-Version: 1.0",
+    ]
+    if text_tpl is None:
+        lines += [
+            'Content-Type: text/html; charset="utf-8"',
+            "Content-Transfer-Encoding: 8bit",
+            "",
+            html_tpl.safe_substitute(fields),
+        ]
+        return "\n".join(lines).replace("\n", "\r\n").encode("utf-8")
+    
+    lines += [f'Content-Type: multipart/alternative; boundary="{_MIME_BOUNDARY}"', ""]
+    for tpl, subtype in ((text_tpl, "plain"), (html_tpl, "html")):
+        lines += [
+            f"--{_MIME_BOUNDARY}",
+            f'Content-Type: text/{subtype}; charset="utf-8"',
+            "Content-Transfer-Encoding: 8bit",
+            "",
+            tpl.safe_substitute(fields),
+        ]
+    lines += [f"--{_MIME_BOUNDARY}--", ""]
+    return "\n".join(lines).replace("\n", "\r\n").encode("utf-8")
+
+def _render_message(skeleton: bytes, **values: str) -> bytes:
+    """Fill the placeholders of a pre-serialized message"""
+    for key, value in values.items():
+        skeleton = skeleton.replace(_placeholder(key).encode(), value.encode("utf-8"))
+    return skeleton
+
+# Re-serializes non-ASCII parts as base64 for servers without 8BITMIME
+_SMTP_7BIT_POLICY = email.policy.SMTP.clone(cte_type='7bit')
+
+def _prepare_message_body(msg: bytes, supports_8bitmime: bool) -> Tuple[bytes, Tuple[str, ...]]:
+    """Return the message and MAIL FROM options to send it with. ASCII-only messages
+    are labelled 7bit; others need BODY=8BITMIME (RFC 6152) or are re-encoded to 7bit."""
+    if msg.isascii():
+        return msg.replace(b"Content-Transfer-Encoding: 8bit", b"Content-Transfer-Encoding: 7bit"), ()
+    if supports_8bitmime:
+        return msg, ("BODY=8BITMIME",)
+    return email.message_from_bytes(msg, policy=email.policy.SMTP).as_bytes(policy=_SMTP_7BIT_POLICY), ()
+
+_RESET_MESSAGE = _build_message_skeleton("Password Reset - Coffee AI", _RESET_TEXT_TPL, _RESET_HTML_TPL)
+_CONFIRMATION_MESSAGE = _build_message_skeleton(
+    "Password Reset Successful - Coffee AI", _CONFIRMATION_TEXT_TPL, _CONFIRMATION_HTML_TPL
+)
+# HTML-only variants: roughly half the bytes on the wire
+_RESET_HTML_ONLY_MESSAGE = _build_message_skeleton("Password Reset - Coffee AI", None, _RESET_HTML_TPL)
+_CONFIRMATION_HTML_ONLY_MESSAGE = _build_message_skeleton(
+    "Password Reset Successful - Coffee AI", None, _CONFIRMATION_HTML_TPL
+)
+
+# Last TLS session per SMTP host, offered again on reconnect so the
+# handshake can be resumed instead of repeated in full
+_tls_sessions: Dict[str, ssl.SSLSession] = {}
+
+class PipeliningSMTP(smtplib.SMTP):
+    """SMTP client that sends MAIL FROM, RCPT TO and DATA in one write when the server supports PIPELINING (RFC 2920)"""
+    
+    def starttls(self, keyfile=None, certfile=None, context=None):
+        """STARTTLS that resumes the previous TLS session with this host when one is cached"""
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn("starttls"):
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+        resp, reply = self.docmd("STARTTLS")
+        if resp != 220:
+            raise smtplib.SMTPResponseException(resp, reply)
+        if context is None:
+            context = get_ssl_context()
+        session = _tls_sessions.get(self._host)
+        self.sock = context.wrap_socket(self.sock, server_hostname=self._host, session=session)
+        # Forget all knowledge obtained before the handshake, as smtplib does
+        self.file = None
+        self.helo_resp = None
+        self.ehlo_resp = None
+        self.esmtp_features = {}
+        self.does_esmtp = False
+        return resp, reply
+    
+    def close(self):
+        # TLS 1.3 tickets arrive after the handshake, so capture the session last
+        if isinstance(self.sock, ssl.SSLSocket) and self.sock.session is not None:
+            _tls_sessions[self._host] = self.sock.session
+        super().close()
+    
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        if isinstance(msg, str):
+            msg = smtplib._fix_eols(msg).encode('ascii')
+        msg, body_options = _prepare_message_body(msg, self.has_extn('8bitmime'))
+        if not self.has_extn('pipelining') or mail_options or rcpt_options:
+            return super().sendmail(from_addr, to_addrs, msg, [*mail_options, *body_options], rcpt_options)
+        
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        
+        size_opt = f" SIZE={len(msg)}" if self.has_extn('size') else ""
+        body_opt = "".join(f" {option}" for option in body_options)
+        commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{size_opt}{body_opt}"]
+        commands.extend(f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in to_addrs)
+        commands.append("DATA")
+        self.send("".join(command + smtplib.CRLF for command in commands))
+        
+        # Replies arrive in command order
+        mail_code, mail_resp = self.getreply()
+        refused = {}
+        for addr in to_addrs:
+            code, resp = self.getreply()
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        data_code, data_resp = self.getreply()
+        
+        if data_code == 354 and (mail_code != 250 or len(refused) == len(to_addrs)):
+            # Server opened DATA anyway; close it with an empty message
+            self.send(b"." + smtplib.bCRLF)
+            self.getreply()
+        if mail_code != 250:
+            self._rset()
+            raise smtplib.SMTPSenderRefused(mail_code, mail_resp, from_addr)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            self._rset()
+            raise smtplib.SMTPDataError(data_code, data_resp)
+        
+        payload = smtplib._quote_periods(msg)
+        if payload[-2:] != smtplib.bCRLF:
+            payload += smtplib.bCRLF
+        self.send(payload + b"." + smtplib.bCRLF)
+        code, resp = self.getreply()
+        if code != 250:
+            self._rset()
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+class SMTPRateLimitedError(smtplib.SMTPException):
+    """Raised when a send is refused locally to stay under the server's rate limit"""
+
+class _TokenBucket:
+    """Thread-safe token bucket allowing `rate` sends per second with bursts up to `rate`"""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _take(self) -> float:
+        """Take a token if one is available; return 0, or the seconds until one is. Caller must hold the lock."""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens < 1.0:
+            return (1.0 - self._tokens) / self.rate
+        self._tokens -= 1.0
+        return 0.0
+    
+    def try_acquire(self) -> bool:
+        with self._lock:
+            return self._take() == 0.0
+    
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self._lock:
+                wait = self._take()
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+# One bucket per SMTP server, shared by every EmailService using it
+_rate_limiters: Dict[str, _TokenBucket] = {}
+_rate_limiters_lock = threading.Lock()
+
+def _get_rate_limiter(smtp_server: str, rate: float) -> _TokenBucket:
+    with _rate_limiters_lock:
+        if smtp_server not in _rate_limiters:
+            _rate_limiters[smtp_server] = _TokenBucket(rate)
+        return _rate_limiters[smtp_server]
+
+@functools.lru_cache(maxsize=1)
+def get_ssl_context() -> ssl.SSLContext:
+    """Build the default TLS context once; loading the CA bundle is expensive"""
+    context = ssl.create_default_context()
+    # Keep session tickets enabled so reconnects can resume
+    context.options &= ~ssl.OP_NO_TICKET
+    return context
+
 class EmailService:
     def __init__(self):
         self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
@@ -27,176 +355,270 @@ class EmailService:
         self.email = os.getenv('GMAIL_EMAIL')
         self.password = os.getenv('GMAIL_APP_PASSWORD')
         self.frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:5173')
+        self._reset_url_prefix = self.frontend_url.rstrip('/') + '/reset-password?token='
+        self._ssl_context = get_ssl_context()
+        self._rate_limiter = _get_rate_limiter(
+            self.smtp_server, float(os.getenv('SMTP_MAX_PER_SEC', str(SMTP_MAX_PER_SEC)))
+        )
+        
+        # Authenticated SMTP session shared by all sends on this instance
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+        self._smtp_opened_at = 0.0
+        self._smtp_sent_count = 0
+        atexit.register(self.close)
+        
+        # Pool of aiosmtplib clients, created on first async send
+        self._aio_pool: Optional[asyncio.Queue] = None
         
         if not self.email or not self.password:
             logger.warning("Gmail credentials not configured. Email functionality will be disabled.")
+            # Decide once: the real send methods assume credentials are present
+            self.send_password_reset_email = self._disabled_send
+            self.send_password_reset_confirmation_email = self._disabled_send
+            self.send_password_reset_confirmation_emails_bulk = self._disabled_send_bulk
+            self.send_password_reset_email_aio = self._disabled_send_aio
+            self.send_password_reset_confirmation_email_aio = self._disabled_send_aio
     
-    def send_password_reset_email(self, recipient_email: str, reset_token: str, user_name: str = None) -> bool:
-        """Send password reset email"""
-        if not self.email or not self.password:
-            logger.error("Gmail credentials not configured")
+    def _disabled_send(self, *args, **kwargs) -> bool:
+        """Stand-in for the send methods when credentials are missing"""
+        logger.error("Gmail credentials not configured")
+        return False
+    
+    def _disabled_send_bulk(self, recipients: List[Tuple[str, Optional[str]]]) -> Dict[str, bool]:
+        """Bulk stand-in for the send methods when credentials are missing"""
+        self._disabled_send()
+        return {recipient_email: False for recipient_email, _ in recipients}
+    
+    async def _disabled_send_aio(self, *args, **kwargs) -> bool:
+        """Async stand-in for the send methods when credentials are missing"""
+        return self._disabled_send()
+    
+    def _connect(self) -> smtplib.SMTP:
+        """Open a new SMTP session, upgrade it to TLS and authenticate"""
+        server = PipeliningSMTP(self.smtp_server, self.smtp_port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls(context=self._ssl_context)
+            server.login(self.email, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._smtp_opened_at = time.monotonic()
+        self._smtp_sent_count = 0
+        return server
+    
+    def _is_connection_usable(self) -> bool:
+        """Check that the cached session is alive and not due for recycling"""
+        if self._smtp is None:
             return False
+        if (time.monotonic() - self._smtp_opened_at > SMTP_CONNECTION_MAX_AGE
+                or self._smtp_sent_count >= SMTP_CONNECTION_MAX_MESSAGES):
+            return False
+        try:
+            code, _ = self._smtp.noop()
+            return code == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+    
+    def _drop_connection(self):
+        """Discard the cached session, quitting politely when possible"""
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+    
+    def _get_connection(self) -> smtplib.SMTP:
+        """Return the cached SMTP session, reconnecting if it is stale. Caller must hold the lock."""
+        if not self._is_connection_usable():
+            self._drop_connection()
+            self._smtp = self._connect()
+        return self._smtp
+    
+    def _acquire_send_slot(self, block: bool = False):
+        """Take a token from the server's rate limiter; fail fast when none is left unless block=True"""
+        if block:
+            self._rate_limiter.acquire()
+        elif not self._rate_limiter.try_acquire():
+            raise SMTPRateLimitedError(f"Send rate limit reached for {self.smtp_server}")
+    
+    def _sendmail_locked(self, recipient_email: str, message: bytes, block: bool = False):
+        """Send a serialized message over the shared session, retrying once on a dropped connection. Caller must hold the lock."""
+        self._acquire_send_slot(block)
+        try:
+            self._get_connection().sendmail(self.email, recipient_email, message)
+        except smtplib.SMTPServerDisconnected:
+            # Timeouts surface here too; smtplib has already closed the socket
+            self._smtp = None
+            try:
+                self._get_connection().sendmail(self.email, recipient_email, message)
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                raise
+        self._smtp_sent_count += 1
+    
+    def _sendmail(self, recipient_email: str, message: bytes):
+        """Send a serialized message over the shared session"""
+        with self._smtp_lock:
+            self._sendmail_locked(recipient_email, message)
+    
+    def close(self):
+        """Close the cached SMTP session"""
+        with self._smtp_lock:
+            self._drop_connection()
+    
+    async def _aio_sendmail(self, recipient_email: str, message: bytes):
+        """Send a serialized message on a pooled aiosmtplib session"""
+        try:
+            import aiosmtplib
+        except ImportError as e:
+            raise ImportError("Missing aiosmtplib package") from e
         
+        self._acquire_send_slot()
+        if self._aio_pool is None:
+            # Slots start empty and connect lazily
+            self._aio_pool = asyncio.Queue()
+            for _ in range(AIO_SMTP_POOL_SIZE):
+                self._aio_pool.put_nowait(None)
+        
+        client = await self._aio_pool.get()
         try:
-            # Create message
-            message = MIMEMultipart("alternative")
-            message["Subject"] = "Password Reset - Coffee AI"
-            message["From"] = self.email
-            message["To"] = recipient_email
-            
-            # Create reset URL
-            reset_url = f"{self.frontend_url}/reset-password?token={reset_token}"
-            
-            # Create the plain-text and HTML version of your message
-            text = f"""
-            Hello {user_name or 'there'},
-            
-            You requested a password reset for your Coffee AI account.
-            
-            Click the following link to reset your password:
-            {reset_url}
-            
-            This link will expire in 1 hour for security reasons.
-            
-            If you didn't request this password reset, please ignore this email.
-            
-            Best regards,
-            Coffee AI Team
-            """
+            if client is None or not client.is_connected:
+                client = aiosmtplib.SMTP(
+                    hostname=self.smtp_server, port=self.smtp_port, start_tls=False, timeout=SMTP_TIMEOUT
+                )
+                await client.connect()
+                await client.starttls(tls_context=self._ssl_context)
+                await client.login(self.email, self.password)
+            message, body_options = _prepare_message_body(message, client.supports_extension('8bitmime'))
+            await client.sendmail(self.email, [recipient_email], message, mail_options=list(body_options))
+        except Exception:
+            if client is not None:
+                client.close()
+            client = None
+            raise
+        finally:
+            self._aio_pool.put_nowait(client)
+    
+    def _build_reset_message(self, recipient_email: str, reset_token: str, user_name: str = None,
+                             simple: bool = False) -> bytes:
+        """Render the password reset message for a recipient"""
+        reset_url = self._reset_url_prefix + urllib.parse.quote(reset_token, safe='')
+        return _render_message(
+            _RESET_HTML_ONLY_MESSAGE if simple else _RESET_MESSAGE,
+            sender=self.email,
+            recipient=recipient_email,
+            user_name=user_name or 'there',
+            reset_url=reset_url
+        )
+    
+    def _build_confirmation_message(self, recipient_email: str, user_name: str = None,
+                                    simple: bool = False) -> bytes:
+        """Render the password reset confirmation message for a recipient"""
+        return _render_message(
+            _CONFIRMATION_HTML_ONLY_MESSAGE if simple else _CONFIRMATION_MESSAGE,
+            sender=self.email,
+            recipient=recipient_email,
+            user_name=user_name or 'there'
+        )
+    
+    def send_password_reset_email(self, recipient_email: str, reset_token: str, user_name: str = None,
+                                  simple: bool = False) -> bool:
+        """Send password reset email; simple=True sends HTML only, without the plain-text alternative"""
+        try:
+            message = self._build_reset_message(recipient_email, reset_token, user_name, simple)
             
-            html = f"""
-            <html>
-              <body>
-                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                  <h2 style="color: #8B4513;">Password Reset - Coffee AI</h2>
-                  
-                  <p>Hello {user_name or 'there'},</p>
-                  
-                  <p>You requested a password reset for your Coffee AI account.</p>
-                  
-                  <div style="text-align: center; margin: 30px 0;">
-                    <a href="{reset_url}" 
-                       style="background-color: #8B4513; color: white; padding: 12px 24px; 
-                              text-decoration: none; border-radius: 5px; display: inline-block;">
-                      Reset Password
-                    </a>
-                  </div>
-                  
-                  <p style="color: #666; font-size: 14px;">
-                    This link will expire in 1 hour for security reasons.
-                  </p>
-                  
-                  <p style="color: #666; font-size: 14px;">
-                    If you didn't request this password reset, please ignore this email.
-                  </p>
-                  
-                  <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
-                  
-                  <p style="color: #999; font-size: 12px;">
-                    Best regards,<br>
-                    Coffee AI Team
-                  </p>
-                </div>
-              </body>
-            </html>
-            """
+            # Send over the persistent authenticated connection
+            self._sendmail(recipient_email, message)
             
-            # Turn these into plain/html MIMEText objects
-            part1 = MIMEText(text, "plain")
-            part2 = MIMEText(html, "html")
+            logger.info("Password reset email sent successfully to %s", recipient_email)
+            return True
             
-            # Add HTML/plain-text parts to MIMEMultipart message
-            message.attach(part1)
-            message.attach(part2)
+        except Exception as e:
+            logger.error("Failed to send password reset email to %s: %s", recipient_email, e)
+            return False
+    
+    def send_password_reset_confirmation_email(self, recipient_email: str, user_name: str = None,
+                                               simple: bool = False) -> bool:
+        """Send password reset confirmation email; simple=True sends HTML only"""
+        try:
+            message = self._build_confirmation_message(recipient_email, user_name, simple)
             
-            # Create secure connection with server and send email
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                server.sendmail(self.email, recipient_email, message.as_string())
+            # Send over the persistent authenticated connection
+            self._sendmail(recipient_email, message)
             
-            logger.info(f"Password reset email sent successfully to {recipient_email}")
+            logger.info("Password reset confirmation email sent successfully to %s", recipient_email)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to send password reset email to {recipient_email}: {str(e)}")
+            logger.error("Failed to send password reset confirmation email to %s: %s", recipient_email, e)
             return False
     
-    def send_password_reset_confirmation_email(self, recipient_email: str, user_name: str = None) -> bool:
-        """Send password reset confirmation email"""
-        if not self.email or not self.password:
-            logger.error("Gmail credentials not configured")
+    def send_password_reset_confirmation_emails_bulk(self, recipients: List[Tuple[str, Optional[str]]]) -> Dict[str, bool]:
+        """Send confirmation emails to many (email, user_name) recipients over one SMTP session"""
+        # Sender is the same for every copy; only recipient and greeting vary
+        skeleton = _render_message(_CONFIRMATION_MESSAGE, sender=self.email)
+        results = {}
+        with self._smtp_lock:
+            for recipient_email, user_name in recipients:
+                message = _render_message(skeleton, recipient=recipient_email, user_name=user_name or 'there')
+                try:
+                    # Bulk sends wait for the rate limiter instead of dropping recipients
+                    self._sendmail_locked(recipient_email, message, block=True)
+                    results[recipient_email] = True
+                except Exception as e:
+                    logger.error("Failed to send password reset confirmation email to %s: %s", recipient_email, e)
+                    results[recipient_email] = False
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Sent %d/%d password reset confirmation emails", sum(results.values()), len(results))
+        return results
+    
+    def send_password_reset_email_async(self, recipient_email: str, reset_token: str, user_name: str = None,
+                                        simple: bool = False) -> Future:
+        """Queue a password reset email on the background sender pool"""
+        return _send_executor.submit(self.send_password_reset_email, recipient_email, reset_token, user_name, simple)
+    
+    def send_password_reset_confirmation_email_async(self, recipient_email: str, user_name: str = None,
+                                                     simple: bool = False) -> Future:
+        """Queue a password reset confirmation email on the background sender pool"""
+        return _send_executor.submit(self.send_password_reset_confirmation_email, recipient_email, user_name, simple)
+    
+    async def send_password_reset_email_aio(self, recipient_email: str, reset_token: str, user_name: str = None,
+                                            simple: bool = False) -> bool:
+        """Send password reset email without blocking the event loop"""
+        try:
+            message = self._build_reset_message(recipient_email, reset_token, user_name, simple)
+            await self._aio_sendmail(recipient_email, message)
+            logger.info("Password reset email sent successfully to %s", recipient_email)
+            return True
+        except Exception as e:
+            logger.error("Failed to send password reset email to %s: %s", recipient_email, e)
             return False
-        
+    
+    async def send_password_reset_confirmation_email_aio(self, recipient_email: str, user_name: str = None,
+                                                         simple: bool = False) -> bool:
+        """Send password reset confirmation email without blocking the event loop"""
         try:
-            # Create message
-            message = MIMEMultipart("alternative")
-            message["Subject"] = "Password Reset Successful - Coffee AI"
-            message["From"] = self.email
-            message["To"] = recipient_email
-            
-            # Create the plain-text and HTML version of your message
-            text = f"""
-            Hello {user_name or 'there'},
-            
-            Your password has been successfully reset for your Coffee AI account.
-            
-            If you didn't make this change, please contact our support team immediately.
-            
-            Best regards,
-            Coffee AI Team
-            """
-            
-            html = f"""
-            <html>
-              <body>
-                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                  <h2 style="color: #8B4513;">Password Reset Successful - Coffee AI</h2>
-                  
-                  <p>Hello {user_name or 'there'},</p>
-                  
-                  <p>Your password has been successfully reset for your Coffee AI account.</p>
-                  
-                  <div style="background-color: #d4edda; border: 1px solid #c3e6cb; 
-                              color: #155724; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                    <strong>✓ Password Reset Complete</strong><br>
-                    You can now log in with your new password.
-                  </div>
-                  
-                  <p style="color: #dc3545; font-weight: bold;">
-                    If you didn't make this change, please contact our support team immediately.
-                  </p>
-                  
-                  <hr style="border: none; border-top: 1px solid #eee; margin: 20px 0;">
-                  
-                  <p style="color: #999; font-size: 12px;">
-                    Best regards,<br>
-                    Coffee AI Team
-                  </p>
-                </div>
-              </body>
-            </html>
-            """
-            
-            # Turn these into plain/html MIMEText objects
-            part1 = MIMEText(text, "plain")
-            part2 = MIMEText(html, "html")
-            
-            # Add HTML/plain-text parts to MIMEMultipart message
-            message.attach(part1)
-            message.attach(part2)
-            
-            # Create secure connection with server and send email
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.email, self.password)
-                server.sendmail(self.email, recipient_email, message.as_string())
-            
-            logger.info(f"Password reset confirmation email sent successfully to {recipient_email}")
+            message = self._build_confirmation_message(recipient_email, user_name, simple)
+            await self._aio_sendmail(recipient_email, message)
+            logger.info("Password reset confirmation email sent successfully to %s", recipient_email)
             return True
-            
         except Exception as e:
-            logger.error(f"Failed to send password reset confirmation email to {recipient_email}: {str(e)}")
+            logger.error("Failed to send password reset confirmation email to %s: %s", recipient_email, e)
             return False
+
+
+# Process-wide instance so the SMTP sessions and SSL context are shared
+_email_service: Optional[EmailService] = None
+_email_service_lock = threading.Lock()
+
+def get_email_service() -> EmailService:
+    """Return the shared EmailService, creating it on first use"""
+    global _email_service
+    if _email_service is None:
+        with _email_service_lock:
+            if _email_service is None:
+                _email_service = EmailService()
+    return _email_service
@@ -13,6 +13,7 @@ from .config import (
     EMBEDDING_MODEL_NAME,
     CHROMA_DB_DIR,
     CHROMA_COLLECTION_NAME,
+    CHROMA_COLLECTION_METADATA,
     CHUNK_SIZE_QA,
     CHUNK_OVERLAP_QA
 )
@@ -31,7 +32,8 @@ def create_vectorstore() -> Chroma:
     vectorstore = Chroma(
         collection_name=CHROMA_COLLECTION_NAME,
         embedding_function=embedding_model,
-        persist_directory=CHROMA_DB_DIR
+        persist_directory=CHROMA_DB_DIR,
+        collection_metadata=CHROMA_COLLECTION_METADATA
     )
     
     return vectorstore
@@ -5,7 +5,7 @@ from langchain_core.documents import Document
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
 from tqdm import tqdm
-from .config import PRODUCT_JSON_PATH, EMBEDDING_MODEL_NAME, CHROMA_DB_DIR
+from .config import PRODUCT_JSON_PATH, EMBEDDING_MODEL_NAME, CHROMA_DB_DIR, CHROMA_COLLECTION_METADATA
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -65,7 +65,8 @@ def create_vectorstore() -> Chroma:
     vectorstore = Chroma(
         collection_name="product_data",
         embedding_function=embedding_model,
-        persist_directory=CHROMA_DB_DIR
+        persist_directory=CHROMA_DB_DIR,
+        collection_metadata=CHROMA_COLLECTION_METADATA
     )
     
     return vectorstore
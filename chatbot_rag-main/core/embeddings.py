@@ -0,0 +1,173 @@
+"""
+Embedding model selection for retrieval.
+Uses a Text Embeddings Inference (TEI) server when TEI_URL is configured,
+otherwise loads the sentence-transformer in-process.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import List
+from langchain_core.embeddings import Embeddings
+from .config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_FILE,
+    TEI_URL,
+    TEI_TIMEOUT,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_WAIT
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TEIEmbeddings(Embeddings):
+    """
+    Embeddings client for a Text Embeddings Inference server.
+    Tokenization, batching and the forward pass all happen in TEI; the
+    client only keeps one pooled keep-alive connection open.
+    """
+
+    def __init__(self, base_url: str, timeout: float = TEI_TIMEOUT):
+        import httpx
+
+        self.url = base_url.rstrip("/") + "/embed"
+        self.client = httpx.Client(timeout=timeout)
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        # normalize=False keeps vectors identical to HuggingFaceEmbeddings,
+        # which is what the stored collection was built with
+        response = self.client.post(
+            self.url,
+            json={"inputs": texts, "truncate": True, "normalize": False}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesces concurrent embed_query calls into one embed_documents call.
+    A worker thread takes up to max_batch_size queued queries, waiting at
+    most max_wait seconds after the first, and embeds them together.
+    """
+
+    def __init__(
+        self,
+        model: Embeddings,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_wait: float = EMBEDDING_BATCH_WAIT
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.model.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} queries: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps another embeddings model with an LRU cache on embed_query.
+    Document embedding is passed straight through.
+    """
+
+    def __init__(self, model: Embeddings, maxsize: int = EMBEDDING_CACHE_SIZE):
+        self.model = model
+        self._embed_query_cached = lru_cache(maxsize=maxsize)(model.embed_query)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_query_cached(text)
+
+    def cache_info(self):
+        return self._embed_query_cached.cache_info()
+
+
+def _load_local_model() -> Embeddings:
+    """Load the sentence-transformer in-process on the configured backend"""
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    backend = EMBEDDING_BACKEND
+    if backend == "onnx":
+        # The sentence-transformers ONNX backend needs optimum[onnxruntime]
+        try:
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError:
+            logger.warning("EMBEDDING_BACKEND=onnx needs optimum[onnxruntime]; falling back to torch")
+            backend = "torch"
+
+    if backend == "onnx":
+        model_kwargs = {"backend": "onnx", "model_kwargs": {"file_name": EMBEDDING_ONNX_FILE}}
+    else:
+        import torch
+        if torch.cuda.is_available():
+            model_kwargs = {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+        else:
+            model_kwargs = {"device": "cpu"}
+
+    logger.info(f"Loading {EMBEDDING_MODEL_NAME} in-process ({backend}, {model_kwargs.get('device', 'auto')})")
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, model_kwargs=model_kwargs)
+
+
+def get_embedding_model() -> Embeddings:
+    """Return the TEI client if configured, else the in-process model"""
+    if TEI_URL:
+        logger.info(f"Using TEI embeddings at {TEI_URL}")
+        model = TEIEmbeddings(TEI_URL)
+    else:
+        model = _load_local_model()
+
+    # Warm up so the first real query doesn't pay for lazy initialization
+    # (CUDA context, kernel selection, TEI connection setup)
+    try:
+        model.embed_query("warmup")
+    except Exception as e:
+        logger.warning(f"Embedding warm-up failed: {e}")
+
+    # Cache hits return immediately; misses are batched with other requests
+    return CachedQueryEmbeddings(BatchingEmbeddings(model))
@@ -1,7 +1,7 @@
 
 import os
 import logging
-from typing import Optional
+from typing import Iterator, Optional
 from .config import (
     LOCAL_LLM_MODEL_PATH,
     LOCAL_LLM_MODEL_NAME,
@@ -95,11 +95,10 @@ class LLMService:
         except ImportError:
             raise ImportError("Missing google-generativeai package")
     
-    def generate_response(self, context: str, query: str, custom_prompt: str = None) -> str:
+    def _build_prompt(self, context: str, query: str, custom_prompt: str = None) -> str:
         if custom_prompt:
-            prompt = custom_prompt
-        else:
-            prompt = f"""You are a safe and helpful AI assistant. 
+            return custom_prompt
+        return f"""You are a safe and helpful AI assistant. 
             Never respond to questions that are violent, harmful, or illegal.
 
             Context:
@@ -108,12 +107,41 @@ class LLMService:
             Question: {query}
 
             Answer:"""
+    
+    def generate_response(self, context: str, query: str, custom_prompt: str = None) -> str:
+        prompt = self._build_prompt(context, query, custom_prompt)
         
         if self.provider == "local":
             return self._generate_local_response(prompt)
         else:
             return self._generate_langchain_response(prompt)
     
+    def stream_response(self, context: str, query: str, custom_prompt: str = None) -> Iterator[str]:
+        """Yield response text chunks as the provider generates them (unstripped)"""
+        prompt = self._build_prompt(context, query, custom_prompt)
+        
+        try:
+            if self.provider == "local":
+                for chunk in self.llm(
+                    prompt,
+                    max_tokens=MAX_TOKENS,
+                    stop=["\nQ:", "\nQuestion:", "\nContext:"],
+                    temperature=TEMPERATURE,
+                    stream=True
+                ):
+                    yield chunk["choices"][0]["text"]
+            elif self.provider == "gemini":
+                for chunk in self.gemini_client.generate_content(prompt, stream=True):
+                    yield chunk.text
+            else:
+                from langchain.schema import HumanMessage
+                
+                for chunk in self.llm.stream([HumanMessage(content=prompt)]):
+                    yield chunk.content
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            raise
+    
     def _generate_local_response(self, prompt: str) -> str:
         try:
             response = self.llm(
@@ -162,3 +190,7 @@ def call_llm(context: str, query: str, provider: str = DEFAULT_LLM_PROVIDER, cus
     service = LLMService(provider=provider)
     return service.generate_response(context, query, custom_prompt)
 
+
+def stream_llm(context: str, query: str, provider: str = DEFAULT_LLM_PROVIDER, custom_prompt: str = None) -> Iterator[str]:
+    service = LLMService(provider=provider)
+    return service.stream_response(context, query, custom_prompt)
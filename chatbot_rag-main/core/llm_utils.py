@@ -5,13 +5,313 @@ Contains utility functions for LLM operations like intent classification, etc.
 
 import logging
 import re
+import sys
 import json
-from typing import List, Dict, Any
+from itertools import islice
+from collections import deque, namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+try:
+    import ahocorasick  # optional C implementation of the keyword automaton
+except ImportError:
+    ahocorasick = None
+
+
+_TOKEN_RE = re.compile(r"[a-z']+")
+
+# One chat history entry; role is "user" or "assistant"
+ChatMsg = namedtuple("ChatMsg", ["role", "content"])
+
+
+class KeywordMatcher:
+    """
+    Keyword lookup over groups of keywords.
+    
+    Single-word keywords are matched against the tokens of a text by hash
+    lookup (a trailing plural "s" is ignored); multi-word phrases are found
+    as substrings by an Aho-Corasick automaton in one pass over the text.
+    """
+    
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        token_groups: Dict[str, set] = {}
+        keyword_groups: Dict[str, set] = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                target = keyword_groups if " " in keyword else token_groups
+                target.setdefault(keyword, set()).add(group)
+        self._tokens = {token: frozenset(kw_groups) for token, kw_groups in token_groups.items()}
+        
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, kw_groups in keyword_groups.items():
+                self._automaton.add_word(keyword, frozenset(kw_groups))
+            self._automaton.make_automaton()
+            return
+        
+        self._automaton = None
+        # Trie transitions and the groups reported at each node
+        self._goto: List[Dict[str, int]] = [{}]
+        outputs: List[set] = [set()]
+        for keyword, kw_groups in keyword_groups.items():
+            node = 0
+            for char in keyword:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][char] = child
+                    self._goto.append({})
+                    outputs.append(set())
+                node = child
+            outputs[node] |= kw_groups
+        
+        # Failure links, breadth first; each node also reports its suffixes' groups
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                outputs[child] |= outputs[self._fail[child]]
+        self._outputs = [frozenset(groups) for groups in outputs]
+    
+    def groups_in(self, text: str) -> Set[str]:
+        """Return the names of all groups with a keyword occurring in text"""
+        return self.token_groups_in(text) | self.phrase_groups_in(text)
+    
+    def token_groups_in(self, text: str) -> Set[str]:
+        """Return the groups matched by the single-word keywords only"""
+        found = set()
+        tokens = self._tokens
+        for token in set(_TOKEN_RE.findall(text)):
+            kw_groups = tokens.get(token)
+            if kw_groups is None and token.endswith("s"):
+                kw_groups = tokens.get(token[:-1])
+            if kw_groups:
+                found |= kw_groups
+        return found
+    
+    def phrase_groups_in(self, text: str) -> Set[str]:
+        """Return the groups matched by the multi-word phrases only"""
+        found = set()
+        # Every phrase contains a space, so a single word can't hold one
+        if " " not in text:
+            return found
+        if self._automaton is not None:
+            for _, kw_groups in self._automaton.iter(text):
+                found |= kw_groups
+            return found
+        
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                found |= outputs[node]
+        return found
+
+
+# Order taking intent keywords - highest priority for conversational ordering
+ORDER_TAKING_KEYWORDS = [
+    "i want", "i'd like", "can i get", "can i have", "i'll take", "i'll have",
+    "place order", "make order", "order for me", "i need", "give me",
+    "add to cart", "put in cart", "add to my order", "include", "also add",
+    "i'll order", "let me order", "order now",
+    # Specific confirmation keywords for adding items to cart
+    "yes add it", "yes add that", "add it", "add that", "yes please add",
+    "take it", "i'll take that", "yes please", "sounds good", "perfect",
+    # Confirmation with explicit cart language
+    "yes to cart", "add to my cart", "put it in cart", "yes add to cart"
+]
+
+# Simple confirmation/clarification keywords (for product selection, not cart addition)
+CONFIRMATION_KEYWORDS = [
+    "yes", "yeah", "yep", "sure", "okay", "ok", "that one", "the first one",
+    "the second one", "correct", "right", "exactly"
+]
+
+# Checkout intent keywords
+CHECKOUT_KEYWORDS = [
+    "checkout", "complete order", "place my order", "finalize order",
+    "proceed to checkout", "ready to order", "confirm order", "finish order",
+    "complete my order", "submit order", "process order"
+]
+
+# Payment method intent keywords
+PAYMENT_KEYWORDS = [
+    "pay with", "payment method", "i'll pay", "cash payment", "card payment",
+    "upi payment", "digital wallet", "credit card", "debit card",
+    "phonepe", "gpay", "paytm", "amazon pay", "cash", "card", "upi"
+]
+
+# Cart management intent keywords
+CART_KEYWORDS = [
+    "cart", "basket", "my order", "what's in my", "show my", "remove from",
+    "delete from", "change quantity", "update my", "clear cart", "empty cart",
+    "view cart", "check cart", "modify order", "edit order"
+]
+
+# Order status/tracking keywords
+ORDER_STATUS_KEYWORDS = [
+    "order status", "track order", "where is my", "delivery status",
+    "order confirmation", "receipt", "order number", "my orders"
+]
+
+# Sales intent keywords (product browsing/information)
+SALES_KEYWORDS = [
+    "price", "cost", "available", "stock", "catalog", "shop", "store",
+    "discount", "offer", "promo", "new", "recommendation", "suggest",
+    "tell me about", "what do you have", "show me", "browse", "menu",
+    "do you have", "do you sell", "any", "which", "what kind", "what type",
+    "organic coffee", "coffee", "tea", "beans", "drink", "beverage",
+    "flavors", "sizes", "options", "varieties", "selection"
+]
+
+# Refund intent keywords
+REFUND_KEYWORDS = [
+    "refund", "return", "exchange", "cancel", "money back", "replacement",
+    "damaged", "defective", "wrong", "mistake", "complaint", "issue"
+]
+
+# Support intent keywords
+SUPPORT_KEYWORDS = [
+    "help", "support", "contact", "hours", "location", "store", "delivery",
+    "shipping", "payment", "account", "login", "register"
+]
+
+# Intent groups in priority order (first match wins); intent names are
+# interned so lookups keyed by the returned intent compare by identity
+INTENT_PRIORITY = [
+    (sys.intern("order_taking"), ORDER_TAKING_KEYWORDS),
+    (sys.intern("confirmation"), CONFIRMATION_KEYWORDS),
+    (sys.intern("checkout"), CHECKOUT_KEYWORDS),
+    (sys.intern("payment_method"), PAYMENT_KEYWORDS),
+    (sys.intern("cart_management"), CART_KEYWORDS),
+    (sys.intern("order_status"), ORDER_STATUS_KEYWORDS),
+    (sys.intern("sales"), SALES_KEYWORDS),
+    (sys.intern("refund"), REFUND_KEYWORDS),
+    (sys.intern("support"), SUPPORT_KEYWORDS),
+]
+
+GENERAL_INTENT = sys.intern("general")
+
+# Matcher group name for each intent, in priority order
+_INTENT_GROUPS = [(f"intent:{intent}", intent) for intent, _ in INTENT_PRIORITY]
+
+# Payment method mapping, checked in order
+PAYMENT_METHOD_KEYWORDS = {
+    "cash": ["cash", "cash payment", "pay cash", "pay with cash"],
+    "card": ["card", "credit card", "debit card", "card payment", "pay with card"],
+    "upi": ["upi", "phonepe", "gpay", "google pay", "paytm upi", "bhim", "upi payment"],
+    "digital_wallet": ["paytm", "amazon pay", "mobikwik", "freecharge", "wallet", "digital wallet"]
+}
+
+# Words suggesting the query refers back to a previously mentioned product
+REFERENCE_CONFIRMATION_WORDS = ["yes", "yeah", "yep", "sure", "okay", "ok", "add it", "add that", "take it"]
+REFERENCE_WORDS = ["it", "that", "this", "the item", "the product"]
+
+# Keywords that suggest need for specific product information
+PRODUCT_CONTEXT_KEYWORDS = [
+    "this", "that", "it", "the one", "same", "different", "another",
+    "previous", "last", "earlier", "mentioned", "discussed",
+    "compare", "vs", "versus", "difference between",
+    "similar", "like that", "alternative"
+]
+
+# Reference words that suggest continuing previous conversation
+PRODUCT_REFERENCE_KEYWORDS = [
+    "this product", "that coffee", "the beans", "same order",
+    "my order", "my coffee", "my purchase", "what I bought"
+]
+
+# Confirmation keywords that need product and conversation context
+CONTEXT_CONFIRMATION_KEYWORDS = [
+    "yes", "yeah", "yep", "sure", "okay", "ok", "add it", "add that",
+    "take it", "i'll take that", "yes please", "sounds good", "perfect"
+]
+
+# Keywords that suggest need for conversation context
+CHAT_CONTEXT_KEYWORDS = [
+    "continue", "also", "and", "what about", "how about",
+    "yes", "no", "okay", "sure", "thanks", "thank you",
+    "previous", "earlier", "before", "last time",
+    "again", "still", "more", "else", "other"
+]
+
+BANNED_WORDS = ["kill", "murder", "harm", "die", "bomb", "weapon", "stab", "suicide"]
+
+# Whole-word match so e.g. "diet" or "harmony" are not flagged
+_BANNED_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, BANNED_WORDS)) + r")\b", re.IGNORECASE)
+
+# Product listings and cart instructions in earlier assistant messages,
+# found in one scan; the "cart_pid" group is set for cart instructions
+_PRODUCT_OR_CART_RE = re.compile(
+    r'\*\*(?P<name>[^*]+)\*\*\s*\(ID:\s*(?P<pid>\d+)\)\s*-\s*[₹$](?P<price>[0-9.,]+)'
+    r'|ADD TO CART.*Product ID\s*(?P<cart_pid>\d+)'
+)
+
+# Structured format in sales responses: **Product Name** (ID: product_id) - $price
+_STRUCTURED_RE = re.compile(r'\*\*([^*]+)\*\*\s*\(ID:\s*([^)]+)\)\s*-\s*\$([0-9.]+)')
+# Product names mentioned in bold: **Product Name**
+_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+# Common product name patterns; each is scanned separately because their
+# matches overlap and a single alternation would drop some candidates
+_NAME_RES = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(?:our|the)?\s*([A-Z][A-Za-z\s\-]+(?:Blend|Coffee|Tea|Roast|Decaf|Organic|Brazilian|Ethiopian|Colombian|Guatemalan|Medium|Dark|Light))',
+    r'([A-Z][A-Za-z\s\-]*(?:Sm|Rg|Lg))\b',  # Size variations
+    r'([A-Z][A-Za-z\s\-]*(?:Beans?|Coffee|Tea|Blend|Roast))',
+))
+# Currency symbols and thousands separators removed from price strings
+_STRIP_CURRENCY = str.maketrans('', '', '₹$,')
+
+# One automaton over every keyword list in this module
+_KEYWORDS = KeywordMatcher({
+    **{f"intent:{intent}": keywords for intent, keywords in INTENT_PRIORITY},
+    **{f"payment:{method}": keywords for method, keywords in PAYMENT_METHOD_KEYWORDS.items()},
+    "reference:confirmation": REFERENCE_CONFIRMATION_WORDS,
+    "reference:words": REFERENCE_WORDS,
+    "product_context": PRODUCT_CONTEXT_KEYWORDS,
+    "product_reference": PRODUCT_REFERENCE_KEYWORDS,
+    "context_confirmation": CONTEXT_CONFIRMATION_KEYWORDS,
+    "chat_context": CHAT_CONTEXT_KEYWORDS,
+})
+
+# Keyword helpers below are pure functions of their arguments, so repeated
+# short replies ("yes", "ok", "cash") are answered from cache. The cached
+# helpers return the reason for their decision and the public wrappers log
+# it, so the log lines still appear on cache hits
+QUERY_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=1024)
+def _lowered(query: str) -> str:
+    """Lowercased query, shared by the helpers called on the same query"""
+    return query.lower()
+
+
+def _groups_any_of(query: str, wanted: Set[str]) -> Set[str]:
+    """
+    Keyword groups matched in query, for callers that only need to know
+    whether any of the wanted groups matched: the phrase scan is skipped
+    when the query's tokens already hit one of them.
+    """
+    query_lower = _lowered(query)
+    matched = _KEYWORDS.token_groups_in(query_lower)
+    if matched.isdisjoint(wanted):
+        matched |= _KEYWORDS.phrase_groups_in(query_lower)
+    return matched
+
 def classify_intent(query: str) -> str:
     """
     Classify the intent of user query.
@@ -22,128 +322,36 @@ def classify_intent(query: str) -> str:
     Returns:
         Intent classification (sales, order_taking, cart_management, refund, general, etc.)
     """
-    query_lower = query.lower()
-    
-    # Order taking intent keywords - highest priority for conversational ordering
-    order_taking_keywords = [
-        "i want", "i'd like", "can i get", "can i have", "i'll take", "i'll have",
-        "place order", "make order", "order for me", "i need", "give me",
-        "add to cart", "put in cart", "add to my order", "include", "also add",
-        "i'll order", "let me order", "order now",
-        # Specific confirmation keywords for adding items to cart
-        "yes add it", "yes add that", "add it", "add that", "yes please add",
-        "take it", "i'll take that", "yes please", "sounds good", "perfect",
-        # Confirmation with explicit cart language
-        "yes to cart", "add to my cart", "put it in cart", "yes add to cart"
-    ]
-    
-    # Simple confirmation/clarification keywords (for product selection, not cart addition)
-    confirmation_keywords = [
-        "yes", "yeah", "yep", "sure", "okay", "ok", "that one", "the first one",
-        "the second one", "correct", "right", "exactly"
-    ]
-    
-    # Checkout intent keywords
-    checkout_keywords = [
-        "checkout", "complete order", "place my order", "finalize order",
-        "proceed to checkout", "ready to order", "confirm order", "finish order",
-        "complete my order", "submit order", "process order"
-    ]
-    
-    # Payment method intent keywords
-    payment_keywords = [
-        "pay with", "payment method", "i'll pay", "cash payment", "card payment",
-        "upi payment", "digital wallet", "credit card", "debit card",
-        "phonepe", "gpay", "paytm", "amazon pay", "cash", "card", "upi"
-    ]
-    
-    # Cart management intent keywords
-    cart_keywords = [
-        "cart", "basket", "my order", "what's in my", "show my", "remove from",
-        "delete from", "change quantity", "update my", "clear cart", "empty cart",
-        "view cart", "check cart", "modify order", "edit order"
-    ]
-    
-    # Order status/tracking keywords
-    order_status_keywords = [
-        "order status", "track order", "where is my", "delivery status",
-        "order confirmation", "receipt", "order number", "my orders"
-    ]
-    
-    # Sales intent keywords (product browsing/information)
-    sales_keywords = [
-        "price", "cost", "available", "stock", "catalog", "shop", "store",
-        "discount", "offer", "promo", "new", "recommendation", "suggest",
-        "tell me about", "what do you have", "show me", "browse", "menu",
-        "do you have", "do you sell", "any", "which", "what kind", "what type",
-        "organic coffee", "coffee", "tea", "beans", "drink", "beverage",
-        "flavors", "sizes", "options", "varieties", "selection"
-    ]
-    
-    # Refund intent keywords
-    refund_keywords = [
-        "refund", "return", "exchange", "cancel", "money back", "replacement",
-        "damaged", "defective", "wrong", "mistake", "complaint", "issue"
-    ]
-    
-    # Support intent keywords
-    support_keywords = [
-        "help", "support", "contact", "hours", "location", "store", "delivery",
-        "shipping", "payment", "account", "login", "register"
-    ]
-    
-    # Check for order taking intent (highest priority for explicit cart additions)
-    if any(keyword in query_lower for keyword in order_taking_keywords):
-        logger.info(f"Classified as ORDER_TAKING intent: {query[:50]}...")
-        return "order_taking"
-    
-    # Check for simple confirmation intent (for clarifications, not cart additions)
-    if any(keyword in query_lower for keyword in confirmation_keywords):
-        # Check if this is likely a product clarification vs cart confirmation
-        # If query is very short and just a confirmation word, it's likely clarification
-        if len(query.strip().split()) <= 2:
-            logger.info(f"Classified as CONFIRMATION intent: {query[:50]}...")
-            return "confirmation"
-    
-    # Check for checkout intent
-    if any(keyword in query_lower for keyword in checkout_keywords):
-        logger.info(f"Classified as CHECKOUT intent: {query[:50]}...")
-        return "checkout"
-    
-    # Check for payment method intent
-    if any(keyword in query_lower for keyword in payment_keywords):
-        logger.info(f"Classified as PAYMENT_METHOD intent: {query[:50]}...")
-        return "payment_method"
-    
-    # Check for cart management intent
-    if any(keyword in query_lower for keyword in cart_keywords):
-        logger.info(f"Classified as CART_MANAGEMENT intent: {query[:50]}...")
-        return "cart_management"
-    
-    # Check for order status intent
-    if any(keyword in query_lower for keyword in order_status_keywords):
-        logger.info(f"Classified as ORDER_STATUS intent: {query[:50]}...")
-        return "order_status"
-    
-    # Check for sales intent
-    if any(keyword in query_lower for keyword in sales_keywords):
-        logger.info(f"Classified as SALES intent: {query[:50]}...")
-        return "sales"
-    
-    # Check for refund intent
-    if any(keyword in query_lower for keyword in refund_keywords):
-        logger.info(f"Classified as REFUND intent: {query[:50]}...")
-        return "refund"
-    
-    # Check for support intent
-    if any(keyword in query_lower for keyword in support_keywords):
-        logger.info(f"Classified as SUPPORT intent: {query[:50]}...")
-        return "support"
+    intent = _classify_intent_cached(query)
+    _log_intent(query, intent)
+    return intent
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _classify_intent_cached(query: str) -> str:
+    return _intent_from_groups(query, _KEYWORDS.groups_in(_lowered(query)))
+
+
+def _intent_from_groups(query: str, matched: Set[str]) -> str:
+    """Pick the highest priority intent among the matched keyword groups"""
+    # Nothing matched any keyword list: skip straight to general
+    for group, intent in (_INTENT_GROUPS if matched else ()):
+        if group not in matched:
+            continue
+        # A confirmation word only counts as a clarification in a very short
+        # query; otherwise keep checking the lower priority intents
+        if intent == "confirmation" and len(query.strip().split()) > 2:
+            continue
+        return intent
     
     # Default to general
-    logger.info(f"Classified as GENERAL intent: {query[:50]}...")
-    return "general"
+    return GENERAL_INTENT
+
+
+def _log_intent(query: str, intent: str) -> None:
+    logger.info("Classified as %s intent: %.50s...", intent.upper(), query)
 
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
 def extract_payment_method(query: str) -> str:
     """
     Extract payment method from user query
@@ -154,29 +362,21 @@ def extract_payment_method(query: str) -> str:
     Returns:
         Payment method identifier (cash, card, upi, digital_wallet) or None
     """
-    query_lower = query.lower()
+    matched = _KEYWORDS.groups_in(_lowered(query))
     
-    # Payment method mapping
-    payment_mapping = {
-        "cash": ["cash", "cash payment", "pay cash", "pay with cash"],
-        "card": ["card", "credit card", "debit card", "card payment", "pay with card"],
-        "upi": ["upi", "phonepe", "gpay", "google pay", "paytm upi", "bhim", "upi payment"],
-        "digital_wallet": ["paytm", "amazon pay", "mobikwik", "freecharge", "wallet", "digital wallet"]
-    }
-    
-    for method, keywords in payment_mapping.items():
-        if any(keyword in query_lower for keyword in keywords):
+    for method in PAYMENT_METHOD_KEYWORDS:
+        if f"payment:{method}" in matched:
             return method
     
     return None
 
 
-def get_chat_history_context(chat_history: List[Dict[str, str]], limit: int = 5) -> str:
+def get_chat_history_context(chat_history: List[ChatMsg], limit: int = 5) -> str:
     """
     Get formatted chat history context from last N messages.
     
     Args:
-        chat_history: List of chat messages with 'user' and 'assistant' keys
+        chat_history: List of chat messages from the 'user' and 'assistant' roles
         limit: Number of last messages to include
         
     Returns:
@@ -190,21 +390,18 @@ def get_chat_history_context(chat_history: List[Dict[str, str]], limit: int = 5)
     
     # Format the chat history
     context_lines = ["Recent Conversation History:"]
-    for message in recent_messages:
-        role = message.get("role", "unknown")
-        content = message.get("content", "")
-        
+    for role, content in recent_messages:
         if role == "user":
             context_lines.append(f"Customer: {content}")
         elif role == "assistant":
             context_lines.append(f"Assistant: {content}")
     
     formatted_context = "\n".join(context_lines)
-    logger.info(f"Retrieved chat history context with {len(recent_messages)} messages")
+    logger.info("Retrieved chat history context with %d messages", len(recent_messages))
     return formatted_context
 
 
-def resolve_product_reference(query: str, chat_history: List[Dict[str, str]]) -> str:
+def resolve_product_reference(query: str, chat_history: List[ChatMsg]) -> str:
     """
     Resolve product references in query using chat history context.
     
@@ -218,44 +415,36 @@ def resolve_product_reference(query: str, chat_history: List[Dict[str, str]]) ->
     if not chat_history:
         return ""
     
-    query_lower = query.lower()
-    
-    # Look for confirmation words that suggest referencing previous products
-    confirmation_words = ["yes", "yeah", "yep", "sure", "okay", "ok", "add it", "add that", "take it"]
-    reference_words = ["it", "that", "this", "the item", "the product"]
+    # Look for confirmation or reference words that suggest referencing previous products
+    matched = _KEYWORDS.groups_in(_lowered(query))
     
-    is_confirmation = any(word in query_lower for word in confirmation_words)
-    has_reference = any(word in query_lower for word in reference_words)
-    
-    if is_confirmation or has_reference:
+    if "reference:confirmation" in matched or "reference:words" in matched:
         # Look through recent chat history for product mentions
-        for message in reversed(chat_history[-5:]):  # Check last 5 messages
-            if message.get("role") == "assistant":
-                content = message.get("content", "")
+        for message in islice(reversed(chat_history), 5):  # Check last 5 messages
+            if message.role == "assistant":
+                content = message.content
                 
                 # Look for product patterns in assistant messages
-                product_pattern = r'\*\*([^*]+)\*\*\s*\(ID:\s*(\d+)\)\s*-\s*[₹$]([0-9.,]+)'
-                cart_pattern = r'ADD TO CART.*Product ID\s*(\d+)'
-                
-                product_matches = re.findall(product_pattern, content)
-                cart_matches = re.findall(cart_pattern, content)
+                product_lines = []
+                cart_lines = []
+                for match in _PRODUCT_OR_CART_RE.finditer(content):
+                    if match.lastgroup == "cart_pid":
+                        cart_lines.append(f"- Previous cart instruction for Product ID: {match.group('cart_pid')}")
+                    else:
+                        product_lines.append(
+                            f"- {match.group('name').strip()} (ID: {match.group('pid')}) - ₹{match.group('price')}"
+                        )
                 
-                if product_matches or cart_matches:
+                if product_lines or cart_lines:
+                    # Product details first, then cart instructions
                     context_lines = ["Referenced Product from Previous Message:"]
+                    context_lines.extend(product_lines)
+                    context_lines.extend(cart_lines)
                     
-                    # Add product details if found
-                    for match in product_matches:
-                        product_name, product_id, price = match
-                        context_lines.append(f"- {product_name.strip()} (ID: {product_id}) - ₹{price}")
-                    
-                    # Add cart instruction details if found
-                    for product_id in cart_matches:
-                        context_lines.append(f"- Previous cart instruction for Product ID: {product_id}")
-                    
-                    logger.info(f"Resolved product reference for query: {query[:50]}...")
+                    logger.info("Resolved product reference for query: %.50s...", query)
                     return "\n".join(context_lines)
     
-    logger.info(f"No product reference resolved for query: {query[:50]}...")
+    logger.info("No product reference resolved for query: %.50s...", query)
     return ""
 
 
@@ -271,24 +460,14 @@ def format_rag_context(retrieved_docs: List[str], chat_context: str, product_con
     Returns:
         Formatted context string
     """
-    context_parts = []
-    
-    # Add retrieved documents
-    if retrieved_docs:
-        context_parts.append("Retrieved Information:")
-        context_parts.extend(retrieved_docs)
-    
-    # Add chat history context
-    if chat_context:
-        context_parts.append("\nPrevious Conversation:")
-        context_parts.append(chat_context)
-    
-    # Add product context
-    if product_context:
-        context_parts.append("\nProduct Information:")
-        context_parts.append(product_context)
+    blocks = (
+        "Retrieved Information:\n" + "\n".join(retrieved_docs) if retrieved_docs else None,
+        "Previous Conversation:\n" + chat_context if chat_context else None,
+        "Product Information:\n" + product_context if product_context else None,
+    )
     
-    return "\n".join(context_parts)
+    # Blank line between the sections that are present
+    return "\n\n".join(block for block in blocks if block)
 
 
 def is_safe_query(query: str) -> bool:
@@ -301,38 +480,22 @@ def is_safe_query(query: str) -> bool:
     Returns:
         True if query is safe, False otherwise
     """
-    banned_words = ["kill", "murder", "harm", "die", "bomb", "weapon", "stab", "suicide"]
-    
-    query_lower = query.lower()
-    for word in banned_words:
-        if word in query_lower:
-            logger.warning(f"Unsafe query detected: contains '{word}'")
-            return False
+    match = _BANNED_RE.search(query)
+    if match:
+        logger.warning("Unsafe query detected: contains '%s'", match.group(0).lower())
+        return False
     
     return True
 
 
-def get_specialized_prompt(intent: str, context: str, query: str) -> str:
-    """
-    Get specialized prompt based on intent classification.
-    
-    Args:
-        intent: Intent classification
-        context: Retrieved context
-        query: User query
-        
-    Returns:
-        Specialized prompt for the agent
-    """
-    # Base safety instructions
-    base_safety = """CRITICAL SAFETY INSTRUCTIONS:
+# Base safety instructions shared by every agent prompt
+_BASE_SAFETY = """CRITICAL SAFETY INSTRUCTIONS:
 - Never provide harmful, illegal, or inappropriate content
 - Stay focused on coffee shop assistance
 - Be helpful, professional, and friendly
 - If asked about unrelated topics, politely redirect to coffee shop services"""
 
-    if intent == "order_taking":
-        return f"""{base_safety}
+_ORDER_TAKING_PROMPT = _BASE_SAFETY + """
 
 You are BrewMaster's Order Taking Specialist - an expert at helping customers place orders conversationally.
 
@@ -396,8 +559,7 @@ Customer Order Request: {query}
 
 Order Taking Response:"""
 
-    elif intent == "cart_management":
-        return f"""{base_safety}
+_CART_MANAGEMENT_PROMPT = _BASE_SAFETY + """
 
 You are BrewMaster's Cart Management Specialist - helping customers manage their orders.
 
@@ -431,8 +593,7 @@ Customer Cart Request: {query}
 
 Cart Management Response:"""
 
-    elif intent == "order_status":
-        return f"""{base_safety}
+_ORDER_STATUS_PROMPT = _BASE_SAFETY + """
 
 You are BrewMaster's Order Status Specialist - providing order tracking and status updates.
 
@@ -451,8 +612,7 @@ Customer Status Request: {query}
 
 Order Status Response:"""
 
-    elif intent == "sales":
-        return f"""{base_safety}
+_SALES_PROMPT = _BASE_SAFETY + """
 
 You are BrewMaster's Product Specialist - an expert coffee consultant helping customers discover perfect products.
 
@@ -490,8 +650,7 @@ Customer Question: {query}
 
 Sales Response:"""
 
-    elif intent == "refund":
-        return f"""{base_safety}
+_REFUND_PROMPT = _BASE_SAFETY + """
 
 You are a customer service specialist handling refunds and returns.
 
@@ -510,8 +669,7 @@ Customer Question: {query}
 
 Customer Service Response:"""
 
-    elif intent == "support":
-        return f"""{base_safety}
+_SUPPORT_PROMPT = _BASE_SAFETY + """
 
 You are a customer support specialist providing general assistance.
 
@@ -530,8 +688,7 @@ Customer Question: {query}
 
 Support Response:"""
 
-    else:  # general intent
-        return f"""{base_safety}
+_GENERAL_PROMPT = _BASE_SAFETY + """
 
 You are BrewMaster's General Assistant - providing friendly, helpful responses about our coffee shop.
 
@@ -549,6 +706,83 @@ Customer Question: {query}
 
 General Response:"""
 
+# Prompt template per intent; anything else gets the general prompt
+_PROMPTS = {
+    "order_taking": _ORDER_TAKING_PROMPT,
+    "cart_management": _CART_MANAGEMENT_PROMPT,
+    "order_status": _ORDER_STATUS_PROMPT,
+    "sales": _SALES_PROMPT,
+    "refund": _REFUND_PROMPT,
+    "support": _SUPPORT_PROMPT,
+}
+
+def get_specialized_prompt(intent: str, context: str, query: str) -> str:
+    """
+    Get specialized prompt based on intent classification.
+    
+    Args:
+        intent: Intent classification
+        context: Retrieved context
+        query: User query
+        
+    Returns:
+        Specialized prompt for the agent
+    """
+    template = _PROMPTS.get(intent, _GENERAL_PROMPT)
+    return template.format_map({"context": context, "query": query})
+
+
+def _split_template(template: str) -> Tuple[str, str, str]:
+    """Split a prompt template into the text around its {context} and {query} fields"""
+    head, rest = template.split("{context}")
+    middle, tail = rest.split("{query}")
+    return head, middle, tail
+
+_PROMPT_PARTS = {intent: _split_template(template) for intent, template in _PROMPTS.items()}
+_GENERAL_PROMPT_PARTS = _split_template(_GENERAL_PROMPT)
+
+
+def build_prompt(
+    intent: str,
+    query: str,
+    retrieved_docs: List[str],
+    chat_context: str,
+    product_context: str
+) -> Tuple[str, str]:
+    """
+    Format the RAG context and build the specialized prompt around it in one pass.
+    Same result as format_rag_context followed by get_specialized_prompt.
+    
+    Args:
+        intent: Intent classification
+        query: User query
+        retrieved_docs: Documents retrieved from vector store
+        chat_context: Previous conversation context
+        product_context: Product-specific context
+        
+    Returns:
+        Tuple of (prompt, formatted context)
+    """
+    head, middle, tail = _PROMPT_PARTS.get(intent, _GENERAL_PROMPT_PARTS)
+    context = format_rag_context(retrieved_docs, chat_context, product_context)
+    return "".join((head, context, middle, query, tail)), context
+
+DEFAULT_AGENT_NAME = "BrewMaster Assistant"
+
+# Agent name per intent (read-only)
+_AGENT_NAMES = MappingProxyType({
+    "order_taking": "Order Taking Specialist",
+    "confirmation": "Product Specialist",  # Handle confirmations as sales
+    "cart_management": "Cart Management Specialist",
+    "order_status": "Order Status Specialist",
+    "checkout": "Checkout Specialist",
+    "payment_method": "Payment Specialist",
+    "sales": "Product Specialist",
+    "refund": "Customer Service Agent",
+    "support": "Support Agent",
+    GENERAL_INTENT: DEFAULT_AGENT_NAME
+})
+
 
 def get_agent_name(intent: str) -> str:
     """
@@ -560,20 +794,7 @@ def get_agent_name(intent: str) -> str:
     Returns:
         Agent name string
     """
-    agent_names = {
-        "order_taking": "Order Taking Specialist",
-        "confirmation": "Product Specialist",  # Handle confirmations as sales
-        "cart_management": "Cart Management Specialist", 
-        "order_status": "Order Status Specialist",
-        "checkout": "Checkout Specialist",
-        "payment_method": "Payment Specialist",
-        "sales": "Product Specialist",
-        "refund": "Customer Service Agent",
-        "support": "Support Agent",
-        "general": "BrewMaster Assistant"
-    }
-    
-    return agent_names.get(intent, "BrewMaster Assistant")
+    return _AGENT_NAMES.get(intent, DEFAULT_AGENT_NAME)
 
 
 def should_resolve_product_context(query: str, intent: str) -> bool:
@@ -587,57 +808,47 @@ def should_resolve_product_context(query: str, intent: str) -> bool:
     Returns:
         True if product context should be resolved, False otherwise
     """
-    query_lower = query.lower()
-    
-    # Keywords that suggest need for specific product information
-    product_context_keywords = [
-        "this", "that", "it", "the one", "same", "different", "another",
-        "previous", "last", "earlier", "mentioned", "discussed",
-        "compare", "vs", "versus", "difference between",
-        "similar", "like that", "alternative"
-    ]
-    
-    # Reference words that suggest continuing previous conversation
-    reference_keywords = [
-        "this product", "that coffee", "the beans", "same order",
-        "my order", "my coffee", "my purchase", "what I bought"
-    ]
-    
-    # Confirmation keywords that need product context
-    confirmation_keywords = [
-        "yes", "yeah", "yep", "sure", "okay", "ok", "add it", "add that",
-        "take it", "i'll take that", "yes please", "sounds good", "perfect"
-    ]
-    
+    needed, reason = _should_resolve_product_context_cached(query, intent)
+    logger.info(reason, query)
+    return needed
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _should_resolve_product_context_cached(query: str, intent: str) -> Tuple[bool, str]:
+    return _needs_product_context(query, intent)
+
+
+def _needs_product_context(query: str, intent: str, matched: Optional[Set[str]] = None) -> Tuple[bool, str]:
+    """Body of should_resolve_product_context, with the log message for the decision; matched is looked up if not given"""
     # Always resolve product context for order_taking intent (includes confirmations)
     if intent == "order_taking":
-        logger.info(f"Product context needed for order_taking intent: {query[:50]}...")
-        return True
+        return True, "Product context needed for order_taking intent: %.50s..."
+    
+    if matched is None:
+        if intent in ("sales", "refund"):
+            matched = _groups_any_of(query, {"context_confirmation", "product_context", "product_reference"})
+        else:
+            matched = _groups_any_of(query, {"context_confirmation", "product_context"})
     
     # Always resolve for confirmation responses
-    if any(keyword in query_lower for keyword in confirmation_keywords):
-        logger.info(f"Product context needed for confirmation query: {query[:50]}...")
-        return True
+    if "context_confirmation" in matched:
+        return True, "Product context needed for confirmation query: %.50s..."
     
     # Always check for product context in sales intent with references
     if intent == "sales":
-        if any(keyword in query_lower for keyword in product_context_keywords + reference_keywords):
-            logger.info(f"Product context needed for sales query: {query[:50]}...")
-            return True
+        if "product_context" in matched or "product_reference" in matched:
+            return True, "Product context needed for sales query: %.50s..."
     
     # Check for refund/exchange scenarios
     if intent == "refund":
-        if any(keyword in query_lower for keyword in reference_keywords):
-            logger.info(f"Product context needed for refund query: {query[:50]}...")
-            return True
+        if "product_reference" in matched:
+            return True, "Product context needed for refund query: %.50s..."
     
     # Check for comparison or follow-up questions
-    if any(keyword in query_lower for keyword in product_context_keywords):
-        logger.info(f"Product context needed for reference query: {query[:50]}...")
-        return True
+    if "product_context" in matched:
+        return True, "Product context needed for reference query: %.50s..."
     
-    logger.info(f"No product context needed for query: {query[:50]}...")
-    return False
+    return False, "No product context needed for query: %.50s..."
 
 
 def should_use_chat_history(query: str, intent: str) -> bool:
@@ -651,49 +862,68 @@ def should_use_chat_history(query: str, intent: str) -> bool:
     Returns:
         True if chat history should be used, False otherwise
     """
-    query_lower = query.lower()
-    
-    # Keywords that suggest need for conversation context
-    context_keywords = [
-        "continue", "also", "and", "what about", "how about",
-        "yes", "no", "okay", "sure", "thanks", "thank you",
-        "previous", "earlier", "before", "last time",
-        "again", "still", "more", "else", "other"
-    ]
-    
-    # Confirmation keywords that definitely need context
-    confirmation_keywords = [
-        "yes", "yeah", "yep", "sure", "okay", "ok", "add it", "add that",
-        "take it", "i'll take that", "yes please", "sounds good", "perfect"
-    ]
-    
+    needed, reason = _should_use_chat_history_cached(query, intent)
+    logger.info(reason, query)
+    return needed
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _should_use_chat_history_cached(query: str, intent: str) -> Tuple[bool, str]:
+    return _needs_chat_history(query, intent)
+
+
+def _needs_chat_history(query: str, intent: str, matched: Optional[Set[str]] = None) -> Tuple[bool, str]:
+    """Body of should_use_chat_history, with the log message for the decision; matched is looked up if not given"""
     # Always use chat history for order_taking intent (includes confirmations)
     if intent == "order_taking":
-        logger.info(f"Chat history needed for order_taking intent: {query[:50]}...")
-        return True
+        return True, "Chat history needed for order_taking intent: %.50s..."
+    
+    if matched is None:
+        matched = _groups_any_of(query, {"context_confirmation", "chat_context"})
     
     # Always use history for confirmation responses
-    if any(keyword in query_lower for keyword in confirmation_keywords):
-        logger.info(f"Chat history needed for confirmation query: {query[:50]}...")
-        return True
+    if "context_confirmation" in matched:
+        return True, "Chat history needed for confirmation query: %.50s..."
     
     # Short queries often need context
     if len(query.split()) <= 3:
-        logger.info(f"Chat history needed for short query: {query}")
-        return True
+        return True, "Chat history needed for short query: %s"
     
     # Questions with context references
-    if any(keyword in query_lower for keyword in context_keywords):
-        logger.info(f"Chat history needed for contextual query: {query[:50]}...")
-        return True
+    if "chat_context" in matched:
+        return True, "Chat history needed for contextual query: %.50s..."
     
     # Always use history for follow-up refund questions
     if intent == "refund":
-        logger.info(f"Chat history needed for refund query: {query[:50]}...")
-        return True
+        return True, "Chat history needed for refund query: %.50s..."
+    
+    return False, "No chat history needed for query: %.50s..."
+
+
+def analyze_query(query: str) -> Tuple[bool, str, bool, bool]:
+    """
+    Run the safety check, intent classification and both context decisions
+    on a query, lowercasing and keyword-matching it only once.
     
-    logger.info(f"No chat history needed for query: {query[:50]}...")
-    return False
+    Args:
+        query: User input query
+        
+    Returns:
+        Tuple of (is_safe, intent, use_chat_history, resolve_product_context)
+    """
+    intent, (use_chat_history, history_reason), (use_product_context, product_reason) = _analyze_query_cached(query)
+    _log_intent(query, intent)
+    is_safe = is_safe_query(query)
+    logger.info(history_reason, query)
+    logger.info(product_reason, query)
+    return is_safe, intent, use_chat_history, use_product_context
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _analyze_query_cached(query: str) -> Tuple[str, Tuple[bool, str], Tuple[bool, str]]:
+    matched = _KEYWORDS.groups_in(_lowered(query))
+    intent = _intent_from_groups(query, matched)
+    return intent, _needs_chat_history(query, intent, matched), _needs_product_context(query, intent, matched)
 
 
 def extract_product_info(response: str, product_service=None) -> Dict[str, Any]:
@@ -707,98 +937,85 @@ def extract_product_info(response: str, product_service=None) -> Dict[str, Any]:
     Returns:
         Dictionary containing products mentioned and metadata
     """
-    import re
-    
     products = []
+    seen_ids = set()  # Drop duplicate product IDs as they are found
     
     # First try the structured format: **Product Name** (ID: product_id) - $price
-    structured_pattern = r'\*\*([^*]+)\*\*\s*\(ID:\s*([^)]+)\)\s*-\s*\$([0-9.]+)'
-    structured_matches = re.findall(structured_pattern, response)
-    
-    for match in structured_matches:
-        product_name, product_id, price = match
-        clean_product_id = product_id.strip()
+    for match in _STRUCTURED_RE.finditer(response):
+        clean_product_id = match.group(2).strip()
+        if clean_product_id in seen_ids:
+            continue
+        seen_ids.add(clean_product_id)
         
         products.append({
             "id": clean_product_id,
-            "name": product_name.strip(),
-            "price": float(price.strip()),
+            "name": match.group(1).strip(),
+            "price": float(match.group(3).strip()),
             "buy_link": f"/product/{clean_product_id}",
             "image_url": f"/images/product_{clean_product_id}.jpg"
         })
     
     # If no structured products found, try to extract product names from natural language
     if not products and product_service:
-        # Pattern to match product names mentioned in bold: **Product Name**
-        bold_pattern = r'\*\*([^*]+)\*\*'
-        bold_matches = re.findall(bold_pattern, response)
-        
-        # Common product name patterns in the response
-        name_patterns = [
-            r'(?:our|the)?\s*([A-Z][A-Za-z\s\-]+(?:Blend|Coffee|Tea|Roast|Decaf|Organic|Brazilian|Ethiopian|Colombian|Guatemalan|Medium|Dark|Light))',
-            r'([A-Z][A-Za-z\s\-]*(?:Sm|Rg|Lg))\b',  # Size variations
-            r'([A-Z][A-Za-z\s\-]*(?:Beans?|Coffee|Tea|Blend|Roast))',
-        ]
-        
-        potential_product_names = set()
+        # Product names mentioned in bold (**Product Name**) or matching the
+        # common product name patterns; the latter start and end on a letter,
+        # so only bold text needs stripping
+        potential_product_names = {match.group(1).strip() for match in _BOLD_RE.finditer(response)}
+        for name_re in _NAME_RES:
+            potential_product_names.update(name_re.findall(response))
         
-        # Extract from bold text
-        for match in bold_matches:
-            potential_product_names.add(match.strip())
+        candidate_names = [name for name in potential_product_names if len(name) > 3]  # Skip very short matches
         
-        # Extract using patterns
-        for pattern in name_patterns:
-            matches = re.findall(pattern, response, re.IGNORECASE)
-            for match in matches:
-                if isinstance(match, tuple):
-                    match = match[0]
-                potential_product_names.add(match.strip())
+        # Look up all candidates in one query when the service supports it
+        if hasattr(product_service, 'get_products_bulk'):
+            search_results = product_service.get_products_bulk(candidate_names, limit=5)
+        else:
+            search_results = {
+                name: product_service.get_products(search=name, limit=5).get('products', [])
+                for name in candidate_names
+            }
         
-        # Look up products in database
-        for product_name in potential_product_names:
-            if len(product_name) > 3:  # Skip very short matches
-                # Search for products by name
-                search_results = product_service.get_products(search=product_name, limit=5)
-                for product in search_results.get('products', []):
-                    # Check if the product name is similar enough
-                    if (product_name.lower() in product['name'].lower() or 
-                        product['name'].lower() in product_name.lower()):
-                        
-                        # Parse price properly - handle both numeric and string formats
-                        price = product.get('retail_price', 0)
-                        if isinstance(price, str):
-                            # Remove currency symbols and convert to float
-                            price_str = re.sub(r'[₹$,]', '', price)
-                            try:
-                                price = float(price_str)
-                            except ValueError:
-                                price = 0.0
-                        
-                        products.append({
-                            "id": str(product.get('product_id', product['id'])),
-                            "name": product['name'],
-                            "price": price,
-                            "buy_link": f"/product/{product.get('product_id', product['id'])}",
-                            "image_url": product.get('image_url', f"/images/product_{product.get('product_id', product['id'])}.jpg"),
-                            "description": product.get('description', ''),
-                            "unit_of_measure": product.get('unit_of_measure', ''),
-                            "category": product.get('category', {}).get('name', '')
-                        })
-                        break  # Only add the first match for each name
-    
-    # Remove duplicates based on product ID
-    seen_ids = set()
-    unique_products = []
-    for product in products:
-        if product['id'] not in seen_ids:
-            seen_ids.add(product['id'])
-            unique_products.append(product)
+        for product_name in candidate_names:
+            for product in search_results.get(product_name, []):
+                # Check if the product name is similar enough
+                if (product_name.lower() in product['name'].lower() or 
+                    product['name'].lower() in product_name.lower()):
+                    
+                    # Parse price properly - handle both numeric and string formats
+                    price = product.get('retail_price', 0)
+                    if isinstance(price, (int, float)):
+                        pass
+                    elif isinstance(price, str):
+                        # Remove currency symbols and convert to float
+                        try:
+                            price = float(price.translate(_STRIP_CURRENCY))
+                        except ValueError:
+                            price = 0.0
+                    else:
+                        price = 0.0
+                    
+                    product_id = str(product.get('product_id', product['id']))
+                    if product_id in seen_ids:
+                        break
+                    seen_ids.add(product_id)
+                    
+                    products.append({
+                        "id": product_id,
+                        "name": product['name'],
+                        "price": price,
+                        "buy_link": f"/product/{product.get('product_id', product['id'])}",
+                        "image_url": product.get('image_url', f"/images/product_{product.get('product_id', product['id'])}.jpg"),
+                        "description": product.get('description', ''),
+                        "unit_of_measure": product.get('unit_of_measure', ''),
+                        "category": product.get('category', {}).get('name', '')
+                    })
+                    break  # Only add the first match for each name
     
     return {
-        "products": unique_products,
-        "total_products": len(unique_products),
+        "products": products,
+        "total_products": len(products),
         "response_type": "sales",
-        "has_products": len(unique_products) > 0
+        "has_products": len(products) > 0
     }
 
 
@@ -817,7 +1034,7 @@ def format_sales_response(response: str, intent: str, product_service=None) -> D
     result = {
         "text": response,
         "intent": intent,
-        "agent": get_agent_name(intent),
+        "agent": _AGENT_NAMES.get(intent, DEFAULT_AGENT_NAME),
         "products": [],
         "metadata": {}
     }
@@ -4,17 +4,77 @@ Order Processing Module for Chat-based Ordering
 Handles conversational order taking, cart management, and order completion
 """
 
+import io
 import re
-import json
 import logging
 from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
+from operator import itemgetter
 from datetime import datetime
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Pattern to match ADD TO CART instructions, with or without the emoji and bold markers
+_ADD_TO_CART_RE = re.compile(
+    r'(?:🛒\s*\*\*\s*)?ADD TO CART(?:\s*\*\*)?:\s*Product ID\s*(\d+)(?:,\s*Size:\s*([^,]+))?(?:,\s*Quantity:\s*(\d+))?',
+    re.IGNORECASE
+)
+
+# Pattern to match product mentions with IDs
+_PRODUCT_RE = re.compile(r'\*\*([^*]+)\*\*\s*\(ID:\s*(\d+)\)\s*-\s*[₹$]([0-9.,]+)')
+
+# Phrases showing a response is an order confirmation or completion (all lowercase)
+ORDER_CONTEXT_KEYWORDS: Tuple[str, ...] = (
+    "add to your cart", "would you like to add", "shall i add", "adding to cart",
+    "successfully added", "added to cart", "item added", "order confirmed",
+    "perfect! adding", "great choice! adding", "excellent! i'll add"
+)
+
+# Phrases showing a response confirms the customer's choice
+ORDER_CONFIRMATION_KEYWORDS: Tuple[str, ...] = (
+    "yes, i'll add", "absolutely! adding", "sure thing! adding",
+    "coming right up", "perfect choice", "great selection"
+)
+
+# Cart item categories used for complementary suggestions
+_HAS_COFFEE_RE = re.compile(r'coffee', re.IGNORECASE)
+_HAS_PASTRY_RE = re.compile(r'scone|croissant|pastry', re.IGNORECASE)
+
+_get_quantity = itemgetter('quantity')
+
+# 18% GST
+_TAX_RATE = 0.18
+
+# Message shown with the checkout summary
+_CHECKOUT_MESSAGE_TEMPLATE = """
+**ORDER SUMMARY**
+Subtotal: ₹{subtotal:.2f}
+Tax (18%): ₹{tax_amount:.2f}
+**Total: ₹{total_amount:.2f}**
+
+Items: {item_count}
+
+Ready to place your order? Just say "checkout" or "place order" and I'll guide you through the payment process!
+"""
+
+# Available payment methods, and the same keyed by id
+_PAYMENT_METHODS: Tuple[Dict[str, str], ...] = (
+    {"id": "cash", "name": "Cash Payment", "description": "Pay with cash at pickup/delivery"},
+    {"id": "card", "name": "Card Payment", "description": "Credit/Debit card payment"},
+    {"id": "upi", "name": "UPI Payment", "description": "Pay via UPI (PhonePe, GPay, Paytm)"},
+    {"id": "digital_wallet", "name": "Digital Wallet", "description": "Paytm, Amazon Pay, etc."}
+)
+_PAYMENT_METHODS_BY_ID = {pm["id"]: pm for pm in _PAYMENT_METHODS}
+
+# Either kind of phrase, found in one case-insensitive scan
+_ORDER_CONTEXT_RE = re.compile(
+    "|".join(map(re.escape, ORDER_CONTEXT_KEYWORDS + ORDER_CONFIRMATION_KEYWORDS)),
+    re.IGNORECASE
+)
+
+@dataclass(slots=True)
 class OrderItem:
     """Represents an item in the order"""
     product_id: int
@@ -25,18 +85,31 @@ class OrderItem:
     size: Optional[str] = None
     customizations: Optional[Dict[str, Any]] = None
 
-@dataclass
+@dataclass(slots=True)
 class ChatOrder:
     """Represents an order being built through chat"""
     session_id: str
     items: List[OrderItem]
     total_amount: float
     status: str = "building"  # building, ready_for_checkout, completed
-    created_at: datetime = None
+    created_at: datetime = field(default_factory=datetime.now)
+
+def _size_suffix(size: Optional[str]) -> str:
+    """Size shown after an item name; nothing for the default size"""
+    return f" ({size})" if size and size != 'Regular' else ""
+
+
+@lru_cache(maxsize=128)
+def _render_cart(items: Tuple[Tuple[str, Optional[str], int, float], ...], total: float, total_quantity: int) -> str:
+    """Render (name, size, quantity, price) cart lines for chat display"""
+    buf = io.StringIO()
+    buf.write("**CURRENT CART:**\n")
+    for name, size, quantity, price in items:
+        buf.write(f"- {name}{_size_suffix(size)} - Qty: {quantity} - ₹{price:.2f}\n")
+    buf.write(f"\n**Cart Total**: ₹{total:.2f}\n")
+    buf.write(f"**Total Items**: {total_quantity}")
     
-    def __post_init__(self):
-        if self.created_at is None:
-            self.created_at = datetime.now()
+    return buf.getvalue()
 
 class OrderProcessor:
     """Handles conversational order processing"""
@@ -62,19 +135,13 @@ class OrderProcessor:
             "instructions": []
         }
         
-        # Pattern to match ADD TO CART instructions (with emoji)
-        add_to_cart_pattern = r'🛒\s*\*\*ADD TO CART\*\*:\s*Product ID\s*(\d+)(?:,\s*Size:\s*([^,]+))?(?:,\s*Quantity:\s*(\d+))?'
-        
-        # Alternative pattern without emoji
-        add_to_cart_alt_pattern = r'ADD TO CART:\s*Product ID\s*(\d+)(?:,\s*Size:\s*([^,]+))?(?:,\s*Quantity:\s*(\d+))?'
-        
-        # Pattern to match product mentions with IDs
-        product_pattern = r'\*\*([^*]+)\*\*\s*\(ID:\s*(\d+)\)\s*-\s*[₹$]([0-9.,]+)'
+        # Most responses carry neither a cart instruction nor a product ID,
+        # so skip the regex scans for them
+        if "(ID:" not in response and "ADD TO CART" not in response.upper():
+            return result
         
-        # Look for ADD TO CART instructions (primary pattern)
-        add_matches = re.findall(add_to_cart_pattern, response, re.IGNORECASE)
-        if not add_matches:
-            add_matches = re.findall(add_to_cart_alt_pattern, response, re.IGNORECASE)
+        # Look for ADD TO CART instructions
+        add_matches = _ADD_TO_CART_RE.findall(response)
         
         for match in add_matches:
             product_id, size, quantity = match
@@ -91,24 +158,10 @@ class OrderProcessor:
         
         # If no explicit ADD TO CART, look for product mentions in order-taking responses
         if not result["has_order_action"]:
-            product_matches = re.findall(product_pattern, response)
+            product_matches = _PRODUCT_RE.findall(response)
             
             # Check if this looks like an order confirmation or completion
-            order_keywords = [
-                "add to your cart", "would you like to add", "shall I add", "adding to cart",
-                "successfully added", "added to cart", "item added", "order confirmed",
-                "perfect! adding", "great choice! adding", "excellent! i'll add"
-            ]
-            is_order_context = any(keyword in response.lower() for keyword in order_keywords)
-            
-            # Also check for confirmation responses
-            confirmation_keywords = [
-                "yes, i'll add", "absolutely! adding", "sure thing! adding",
-                "coming right up", "perfect choice", "great selection"
-            ]
-            is_confirmation = any(keyword in response.lower() for keyword in confirmation_keywords)
-            
-            if product_matches and (is_order_context or is_confirmation):
+            if product_matches and _ORDER_CONTEXT_RE.search(response):
                 result["has_order_action"] = True
                 result["action_type"] = "suggest_add_to_cart"
                 
@@ -117,7 +170,7 @@ class OrderProcessor:
                     item_data = {
                         "product_id": int(product_id),
                         "product_name": product_name.strip(),
-                        "price": float(price.replace(',', '')),
+                        "price": float(price.replace(',', '')) if ',' in price else float(price),
                         "quantity": 1
                     }
                     result["items"].append(item_data)
@@ -149,23 +202,45 @@ class OrderProcessor:
             return result
         
         try:
-            for item in action_data["items"]:
-                # Add item to cart using the cart service with user_id
-                cart_result = cart_service.add_to_cart(
-                    session_id=session_id,
-                    product_id=item["product_id"],
-                    quantity=item.get("quantity", 1),
-                    selected_size=item.get("size"),
-                    user_id=user_id
-                )
-                
-                if cart_result:
-                    result["items_added"].append({
+            # Add all items in one call when the cart service supports it
+            if hasattr(cart_service, "bulk_add_to_cart"):
+                items = [
+                    {
                         "product_id": item["product_id"],
                         "quantity": item.get("quantity", 1),
-                        "size": item.get("size")
-                    })
-                    result["cart_updated"] = True
+                        "selected_size": item.get("size")
+                    }
+                    for item in action_data["items"]
+                ]
+                cart_result = cart_service.bulk_add_to_cart(session_id, items, user_id=user_id)
+                if cart_result:
+                    result["items_added"] = [
+                        {"product_id": item["product_id"], "quantity": item["quantity"], "size": item["selected_size"]}
+                        for item in items
+                    ]
+                    result["cart_updated"] = bool(items)
+            else:
+                for item in action_data["items"]:
+                    product_id = item["product_id"]
+                    quantity = item.get("quantity", 1)
+                    size = item.get("size")
+                    
+                    # Add item to cart using the cart service with user_id
+                    cart_result = cart_service.add_to_cart(
+                        session_id=session_id,
+                        product_id=product_id,
+                        quantity=quantity,
+                        selected_size=size,
+                        user_id=user_id
+                    )
+                    
+                    if cart_result:
+                        result["items_added"].append({
+                            "product_id": product_id,
+                            "quantity": quantity,
+                            "size": size
+                        })
+                        result["cart_updated"] = True
             
             if result["cart_updated"]:
                 result["success"] = True
@@ -179,7 +254,8 @@ class OrderProcessor:
         
         return result
     
-    def get_cart_summary(self, session_id: str, cart_service=None, user_id: int = None) -> Dict[str, Any]:
+    def get_cart_summary(self, session_id: str, cart_service=None, user_id: int = None,
+                         cart_data: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Get formatted cart summary for chat responses
         
@@ -187,6 +263,7 @@ class OrderProcessor:
             session_id: User session ID
             cart_service: Cart service instance
             user_id: User ID for cart operations
+            cart_data: Cart already fetched from cart_service (fetched if omitted)
             
         Returns:
             Formatted cart information
@@ -195,7 +272,8 @@ class OrderProcessor:
             return {"error": "Cart service not available"}
         
         try:
-            cart_data = cart_service.get_cart(session_id, user_id)
+            if cart_data is None:
+                cart_data = cart_service.get_cart(session_id, user_id)
             
             if not cart_data or not cart_data.get("items"):
                 return {
@@ -244,22 +322,13 @@ class OrderProcessor:
         if not items:
             return "Your cart is empty."
         
-        lines = ["**CURRENT CART:**"]
-        for item in items:
-            size_info = f" ({item['size']})" if item['size'] and item['size'] != 'Regular' else ""
-            lines.append(f"- {item['name']}{size_info} - Qty: {item['quantity']} - ₹{item['price']:.2f}")
-        
-        lines.append(f"\n**Cart Total**: ₹{total:.2f}")
-        
-        # Use total_quantity if provided, otherwise calculate from items
-        if total_quantity is not None:
-            lines.append(f"**Total Items**: {total_quantity}")
-        else:
-            # Fallback: sum quantities of all items
-            total_qty = sum(item['quantity'] for item in items)
-            lines.append(f"**Total Items**: {total_qty}")
+        # Use total_quantity if provided, otherwise sum quantities of all items
+        if total_quantity is None:
+            total_quantity = sum(map(_get_quantity, items))
         
-        return "\n".join(lines)
+        # Repeated views of an unchanged cart reuse the rendered text
+        items_key = tuple((item['name'], item['size'], item['quantity'], item['price']) for item in items)
+        return _render_cart(items_key, total, total_quantity)
     
     def suggest_complementary_items(self, current_items: List[Dict], 
                                   product_service=None) -> List[Dict]:
@@ -279,11 +348,10 @@ class OrderProcessor:
             return suggestions
         
         try:
-            # Simple complementary logic
-            has_coffee = any("coffee" in item.get("name", "").lower() for item in current_items)
-            has_pastry = any(any(food_type in item.get("name", "").lower() 
-                               for food_type in ["scone", "croissant", "pastry"]) 
-                           for item in current_items)
+            # Simple complementary logic, one scan over all item names per category
+            names_blob = "\n".join(item.get("name", "") for item in current_items)
+            has_coffee = _HAS_COFFEE_RE.search(names_blob) is not None
+            has_pastry = _HAS_PASTRY_RE.search(names_blob) is not None
             
             # Suggest pastries if they have coffee
             if has_coffee and not has_pastry:
@@ -307,18 +375,21 @@ class OrderProcessor:
         
         return suggestions[:3]  # Limit to 3 suggestions
     
-    def create_checkout_summary(self, session_id: str, cart_service=None) -> Dict[str, Any]:
+    def create_checkout_summary(self, session_id: str, cart_service=None, user_id: int = None,
+                                cart_data: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Create a checkout summary for order completion
         
         Args:
             session_id: User session ID
             cart_service: Cart service instance
+            user_id: User ID for cart operations
+            cart_data: Cart already fetched from cart_service (fetched if omitted)
             
         Returns:
             Checkout summary data
         """
-        cart_summary = self.get_cart_summary(session_id, cart_service)
+        cart_summary = self.get_cart_summary(session_id, cart_service, user_id, cart_data)
         
         if cart_summary.get("empty", True):
             return {
@@ -328,8 +399,7 @@ class OrderProcessor:
         
         # Calculate taxes and fees (simplified)
         subtotal = cart_summary["total"]
-        tax_rate = 0.18  # 18% GST
-        tax_amount = subtotal * tax_rate
+        tax_amount = subtotal * _TAX_RATE
         total_amount = subtotal + tax_amount
         
         return {
@@ -339,21 +409,18 @@ class OrderProcessor:
             "total_amount": total_amount,
             "item_count": cart_summary["item_count"],
             "items": cart_summary["items"],
-            "checkout_message": f"""
-**ORDER SUMMARY**
-Subtotal: ₹{subtotal:.2f}
-Tax (18%): ₹{tax_amount:.2f}
-**Total: ₹{total_amount:.2f}**
-
-Items: {cart_summary['item_count']}
-
-Ready to place your order? Just say "checkout" or "place order" and I'll guide you through the payment process!
-"""
+            "checkout_message": _CHECKOUT_MESSAGE_TEMPLATE.format(
+                subtotal=subtotal,
+                tax_amount=tax_amount,
+                total_amount=total_amount,
+                item_count=cart_summary["item_count"]
+            )
         }
     
     def save_chat_order_to_database(self, session_id: str, payment_method: str, 
                                    user_id: int = None, cart_service=None, 
-                                   order_service=None, notes: str = None) -> Dict[str, Any]:
+                                   order_service=None, notes: str = None,
+                                   cart_data: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Save a chat-based order to the database with payment method
         
@@ -364,6 +431,7 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
             cart_service: Cart service instance
             order_service: Order service instance
             notes: Additional order notes
+            cart_data: Cart already fetched from cart_service (fetched if omitted)
             
         Returns:
             Order creation result
@@ -381,7 +449,8 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
         
         try:
             # Get cart data - need to pass user_id to get_cart method
-            cart_data = cart_service.get_cart(session_id, user_id)
+            if cart_data is None:
+                cart_data = cart_service.get_cart(session_id, user_id)
             
             if not cart_data or not cart_data.get("items"):
                 result["message"] = "Cart is empty. Cannot create order."
@@ -389,14 +458,12 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
             
             # Calculate order totals - use correct field names
             subtotal = cart_data["total_amount"]  # The actual field from get_cart
-            tax_rate = 0.18  # 18% GST
-            tax_amount = subtotal * tax_rate
+            tax_amount = subtotal * _TAX_RATE
             total_amount = subtotal + tax_amount
             
             # Prepare order items for database
-            order_items = []
-            for item in cart_data["items"]:
-                order_items.append({
+            order_items = [
+                {
                     "product_id": item["product_id"],
                     "quantity": item["quantity"],
                     "unit_price": item["unit_price"],
@@ -404,7 +471,9 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
                     "selected_size": item.get("selected_size"),
                     "customizations": item.get("customizations"),
                     "notes": item.get("notes")
-                })
+                }
+                for item in cart_data["items"]
+            ]
             
             # Create order data
             order_data = {
@@ -442,19 +511,14 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
         
         return result
     
-    def get_available_payment_methods(self) -> List[Dict[str, str]]:
+    def get_available_payment_methods(self) -> Tuple[Dict[str, str], ...]:
         """
         Get list of available payment methods
         
         Returns:
-            List of payment method options
+            Payment method options (shared, do not modify)
         """
-        return [
-            {"id": "cash", "name": "Cash Payment", "description": "Pay with cash at pickup/delivery"},
-            {"id": "card", "name": "Card Payment", "description": "Credit/Debit card payment"},
-            {"id": "upi", "name": "UPI Payment", "description": "Pay via UPI (PhonePe, GPay, Paytm)"},
-            {"id": "digital_wallet", "name": "Digital Wallet", "description": "Paytm, Amazon Pay, etc."}
-        ]
+        return _PAYMENT_METHODS
     
     def process_checkout_request(self, session_id: str, payment_method: str = None, 
                                user_id: int = None, cart_service=None, 
@@ -478,8 +542,18 @@ Ready to place your order? Just say "checkout" or "place order" and I'll guide y
             "data": {}
         }
         
+        # Fetch the cart once for both the summary and the order
+        cart_data = None
+        if cart_service:
+            try:
+                cart_data = cart_service.get_cart(session_id, user_id)
+            except Exception as e:
+                logger.error(f"Error getting cart for checkout: {e}")
+                result["message"] = f"Error retrieving cart: {str(e)}"
+                return result
+        
         # Get checkout summary
-        checkout_summary = self.create_checkout_summary(session_id, cart_service)
+        checkout_summary = self.create_checkout_summary(session_id, cart_service, user_id, cart_data)
         
         if not checkout_summary.get("ready_for_checkout"):
             result["message"] = checkout_summary.get("message", "Cart is empty")
@@ -505,9 +579,8 @@ Please choose your payment method by saying something like:
             return result
         
         # Validate payment method
-        valid_methods = [pm["id"] for pm in self.get_available_payment_methods()]
-        if payment_method not in valid_methods:
-            result["message"] = f"Invalid payment method. Please choose from: {', '.join(valid_methods)}"
+        if payment_method not in _PAYMENT_METHODS_BY_ID:
+            result["message"] = f"Invalid payment method. Please choose from: {', '.join(_PAYMENT_METHODS_BY_ID)}"
             return result
         
         # Process the order
@@ -517,16 +590,14 @@ Please choose your payment method by saying something like:
             user_id=user_id,
             cart_service=cart_service,
             order_service=order_service,
-            notes="Conversational Order via Chat"
+            notes="Conversational Order via Chat",
+            cart_data=cart_data
         )
         
         if order_result["success"]:
             result["checkout_stage"] = "completed"
             result["data"]["order"] = order_result
-            payment_method_name = next(
-                (pm["name"] for pm in self.get_available_payment_methods() if pm["id"] == payment_method),
-                payment_method
-            )
+            payment_method_name = _PAYMENT_METHODS_BY_ID.get(payment_method, {"name": payment_method})["name"]
             result["message"] = f"""
 🎉 **ORDER CONFIRMED!**
 
@@ -4,22 +4,29 @@ Combines vector retrieval with LLM generation for contextual responses.
 """
 
 import logging
-from typing import List, Dict, Any, Optional
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
 from .config import (
-    EMBEDDING_MODEL_NAME,
     CHROMA_DB_DIR,
-    CHROMA_COLLECTION_NAME
+    CHROMA_COLLECTION_NAME,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_LOG_EVERY,
+    RETRIEVAL_WORKERS
 )
-from .llm_service import call_llm, call_local_llm, call_openai_llm, call_gemini_llm
+from .embeddings import get_embedding_model
+from .llm_service import call_llm, call_local_llm, call_openai_llm, call_gemini_llm, stream_llm
 from .llm_utils import (
-    classify_intent,
+    ChatMsg,
+    analyze_query,
     get_chat_history_context,
     resolve_product_reference,
-    format_rag_context,
+    build_prompt,
     is_safe_query,
-    get_specialized_prompt,
     get_agent_name,
     should_resolve_product_context,
     should_use_chat_history,
@@ -31,6 +38,81 @@ from .order_processor import order_processor
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Runs vector retrieval alongside the in-process context building
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="rag-retrieval")
+
+# Appended to the cart summary when the user asks to see their cart
+_CART_ACTIONS_TEXT = (
+    "\n\n🛒 **Cart Actions Available:**"
+    "\n- Say 'remove [item]' to delete items"
+    "\n- Say 'checkout' or 'place order' to proceed"
+    "\n- Say 'add more' to continue shopping"
+)
+
+# Intents whose answers draw on the product catalog or the Q&A documents.
+# Anything else that reaches generation (cart, checkout or payment requests
+# without a session) is answered without retrieval
+_RETRIEVAL_INTENTS = frozenset({
+    "order_taking", "confirmation", "sales", "order_status", "refund", "support", "general"
+})
+
+# Created on first checkout so importing this module doesn't touch the database
+_order_service = None
+
+
+def _get_order_service():
+    """Return the shared OrderService, creating it on first use"""
+    global _order_service
+    if _order_service is None:
+        from database.db_service import OrderService
+        _order_service = OrderService()
+    return _order_service
+
+
+def _with_product_id(content: str, product_id) -> str:
+    """Insert a Product ID line after the first line (Product: ...)"""
+    first_line, newline, rest = content.partition('\n')
+    if newline:
+        return f"{first_line}\nProduct ID: {product_id}\n{rest}"
+    return f"{content}\nProduct ID: {product_id}"
+
+
+@dataclass(slots=True, frozen=True)
+class RAGResponse:
+    """Response and metadata produced by RAGSystem.generate_response"""
+    response: str
+    intent: str
+    agent: str
+    sources: List[str]
+    context: str
+    products: List[Dict[str, Any]]
+    metadata: Dict[str, Any]
+    chat_history_used: bool
+    product_context_used: bool
+    order_processing: Dict[str, Any]
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """Plain dict form, for JSON responses"""
+        return asdict(self)
+
+
+def _prefetch_vector_index(persist_directory: str) -> None:
+    """
+    Ask the kernel to read the persisted HNSW index files into the page cache,
+    so the first searches don't stall on page faults.
+    """
+    if not hasattr(mmap, "MADV_WILLNEED"):
+        return
+    
+    for index_file in Path(persist_directory).rglob("*.bin"):
+        try:
+            if index_file.stat().st_size == 0:
+                continue
+            with open(index_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                mapped.madvise(mmap.MADV_WILLNEED)
+        except OSError as e:
+            logger.warning(f"Could not prefetch {index_file}: {e}")
+
 
 class RAGSystem:
     """
@@ -39,27 +121,27 @@ class RAGSystem:
     
     def __init__(self, llm_provider: str = "local"):
         self.llm_provider = llm_provider
-        self.retriever = None
+        self.embedding_model = None
+        self.vectorstore = None
+        self._retrieve_cached = lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)(self._retrieve)
+        self._retrieval_calls = 0
         self._initialize_retriever()
     
     def _initialize_retriever(self):
         """Initialize the vector store retriever"""
         try:
-            # Initialize embedding model
-            embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+            # Initialize embedding model (TEI server if configured, else in-process)
+            self.embedding_model = get_embedding_model()
             
             # Load vector store
-            vectorstore = Chroma(
+            self.vectorstore = Chroma(
                 collection_name=CHROMA_COLLECTION_NAME,
-                embedding_function=embedding_model,
+                embedding_function=self.embedding_model,
                 persist_directory=CHROMA_DB_DIR
             )
             
-            # Create retriever
-            self.retriever = vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}  # Top 5 similar documents
-            )
+            # Warm the page cache with the index files before the first query
+            _prefetch_vector_index(CHROMA_DB_DIR)
             
             logger.info("RAG retriever initialized successfully")
             
@@ -79,25 +161,14 @@ class RAGSystem:
             List of relevant document contents with product IDs included
         """
         try:
-            # Update retriever with new k value
-            self.retriever.search_kwargs = {"k": k}
-            
-            # Retrieve documents
-            documents = self.retriever.get_relevant_documents(query)
+            # Repeated queries ("menu", "checkout", ...) are served from cache.
+            # The embedding model is uncased, so lowercasing does not change results
+            query_norm = " ".join(query.lower().split())
+            doc_contents = list(self._retrieve_cached(query_norm, k))
             
-            # Extract content from documents and include product_id if available
-            doc_contents = []
-            for doc in documents:
-                content = doc.page_content
-                # Add product_id to content if available in metadata
-                if hasattr(doc, 'metadata') and doc.metadata and 'product_id' in doc.metadata:
-                    product_id = doc.metadata['product_id']
-                    # Insert product_id after the first line (Product: ...)
-                    lines = content.split('\n')
-                    if lines:
-                        lines.insert(1, f"Product ID: {product_id}")
-                        content = '\n'.join(lines)
-                doc_contents.append(content)
+            self._retrieval_calls += 1
+            if self._retrieval_calls % RETRIEVAL_CACHE_LOG_EVERY == 0:
+                logger.info(f"Retrieval cache: {self._retrieve_cached.cache_info()}")
             
             logger.info(f"Retrieved {len(doc_contents)} relevant documents")
             return doc_contents
@@ -106,16 +177,31 @@ class RAGSystem:
             logger.error(f"Error retrieving documents: {e}")
             return []
     
+    def _retrieve(self, query: str, k: int) -> Tuple[str, ...]:
+        """Run the vector search and return document contents with product IDs"""
+        # Embed the query (batched with concurrent requests), then search by vector
+        query_vector = self.embedding_model.embed_query(query)
+        documents = self.vectorstore.similarity_search_by_vector(query_vector, k=k)
+        
+        # Extract content from documents and include product_id if available
+        return tuple(
+            _with_product_id(doc.page_content, doc.metadata['product_id'])
+            if doc.metadata and 'product_id' in doc.metadata
+            else doc.page_content
+            for doc in documents
+        )
+    
 
     def generate_response(
         self,
         query: str,
-        chat_history: Optional[List[Dict[str, str]]] = None,
+        chat_history: Optional[List[ChatMsg]] = None,
         session_id: Optional[str] = None,
         cart_service=None,
         product_service=None,
-        user_id: Optional[int] = None
-    ) -> Dict[str, Any]:
+        user_id: Optional[int] = None,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> RAGResponse:
         """
         Generate a response using RAG with enhanced order processing capabilities.
         
@@ -126,116 +212,44 @@ class RAGSystem:
             cart_service: Cart service instance for order processing
             product_service: Product service instance
             user_id: User ID for cart operations (guest user for chat sessions)
+            on_token: Optional callback that receives LLM text chunks as they are
+                generated. The final response can still differ, e.g. when a cart
+                action replaces it with the cart summary
             
         Returns:
-            Dictionary containing response and metadata with order processing info
+            RAGResponse with the response text and metadata, including order processing info
         """
         try:
             # Step 1: Classify intent (now includes order_taking, cart_management, etc.)
-            intent = classify_intent(query)
+            # and decide on chat history / product context in the same pass
+            _, intent, use_chat_history, use_product_resolution = analyze_query(query)
             
-            # Step 2: Handle cart management requests specifically
-            if intent == "cart_management" and cart_service and session_id:
-                cart_summary = order_processor.get_cart_summary(session_id, cart_service, user_id)
-                
-                if cart_summary.get("empty", True):
-                    response_text = cart_summary.get("message", "Your cart is empty.")
-                else:
-                    response_text = cart_summary["formatted_summary"]
-                    response_text += "\n\n🛒 **Cart Actions Available:**"
-                    response_text += "\n- Say 'remove [item]' to delete items"
-                    response_text += "\n- Say 'checkout' or 'place order' to proceed"
-                    response_text += "\n- Say 'add more' to continue shopping"
-                
-                return {
-                    "response": str(response_text) if response_text is not None else "",
-                    "intent": str(intent) if intent is not None else "cart_management",
-                    "agent": str(get_agent_name(intent)) if get_agent_name(intent) is not None else "Cart Management Specialist",
-                    "sources": [],
-                    "context": "",
-                    "products": [],
-                    "metadata": {"cart_action": True, "cart_data": cart_summary},
-                    "chat_history_used": False,
-                    "product_context_used": False,
-                    "order_processing": {
-                        "has_cart_action": True,
-                        "cart_summary": cart_summary
-                    }
-                }
+            # Step 2: Cart management, checkout and payment method selection
+            # are answered directly without retrieval or generation
+            handler = self._INTENT_HANDLERS.get(intent)
+            if handler and cart_service and session_id:
+                return handler(self, query, session_id, cart_service, user_id)
             
-            # Step 2b: Handle checkout requests
-            if intent == "checkout" and cart_service and session_id:
-                from database.db_service import OrderService
-                order_service = OrderService()
-                
-                checkout_result = order_processor.process_checkout_request(
-                    session_id=session_id,
-                    cart_service=cart_service,
-                    order_service=order_service
-                )
-                
-                return {
-                    "response": str(checkout_result.get("message", "")) if checkout_result and checkout_result.get("message") is not None else "",
-                    "intent": str(intent) if intent is not None else "checkout",
-                    "agent": str(get_agent_name(intent)) if get_agent_name(intent) is not None else "Checkout Specialist",
-                    "sources": [],
-                    "context": "",
-                    "products": [],
-                    "metadata": {"checkout_data": checkout_result.get("data", {}) if checkout_result else {}},
-                    "chat_history_used": False,
-                    "product_context_used": False,
-                    "order_processing": {
-                        "has_checkout_action": True,
-                        "checkout_result": checkout_result
-                    }
-                }
-            
-            # Step 2c: Handle confirmation responses (product clarifications, not cart additions)
+            # Step 2b: Handle confirmation responses (product clarifications, not cart additions)
             if intent == "confirmation" and session_id:
                 # For confirmations, we want to continue the sales conversation with context
                 # This handles cases like "yes" when choosing between product options
                 intent = "sales"  # Treat as sales intent but with confirmation context
+                use_chat_history = should_use_chat_history(query, intent)
+                use_product_resolution = should_resolve_product_context(query, intent)
                 
-            # Step 2d: Handle payment method selection
-            if intent == "payment_method" and cart_service and session_id:
-                from database.db_service import OrderService
-                from .llm_utils import extract_payment_method
-                
-                order_service = OrderService()
-                payment_method = extract_payment_method(query)
-                
-                checkout_result = order_processor.process_checkout_request(
-                    session_id=session_id,
-                    payment_method=payment_method,
-                    cart_service=cart_service,
-                    order_service=order_service
-                )
-                
-                return {
-                    "response": str(checkout_result.get("message", "")) if checkout_result and checkout_result.get("message") is not None else "",
-                    "intent": str(intent) if intent is not None else "payment_method",
-                    "agent": str(get_agent_name(intent)) if get_agent_name(intent) is not None else "Payment Specialist",
-                    "sources": [],
-                    "context": "",
-                    "products": [],
-                    "metadata": {"checkout_data": checkout_result.get("data", {}) if checkout_result else {}},
-                    "chat_history_used": False,
-                    "product_context_used": False,
-                    "order_processing": {
-                        "has_payment_action": True,
-                        "payment_method": str(payment_method) if payment_method is not None else "",
-                        "checkout_result": checkout_result
-                    }
-                }
-            
-            # Step 3: Intelligent decision on whether to use chat history
-            use_chat_history = should_use_chat_history(query, intent)
+            # Steps 3-4: chat history and product context decisions were made
+            # in step 1 (or redone above if the intent was remapped)
             
-            # Step 4: Intelligent decision on whether to resolve product context
-            use_product_resolution = should_resolve_product_context(query, intent)
-            
-            # Step 5: Retrieve relevant documents
-            retrieved_docs = self.retrieve_relevant_documents(query)
+            # Step 5: Retrieve relevant documents, in the background when
+            # steps 6-7 have chat or product context to build meanwhile
+            docs_future = None
+            retrieved_docs = []
+            if intent in _RETRIEVAL_INTENTS:
+                if use_chat_history or use_product_resolution:
+                    docs_future = _retrieval_executor.submit(self.retrieve_relevant_documents, query)
+                else:
+                    retrieved_docs = self.retrieve_relevant_documents(query)
             
             # Step 6: Get chat history context (only if needed)
             chat_context = ""
@@ -247,18 +261,20 @@ class RAGSystem:
             if use_product_resolution:
                 product_context = resolve_product_reference(query, chat_history)
             
-            # Step 8: Format context
-            formatted_context = format_rag_context(
-                retrieved_docs, 
-                chat_context, 
+            if docs_future:
+                retrieved_docs = docs_future.result()
+            
+            # Steps 8-9: Format context and build the specialized prompt around it
+            specialized_prompt, formatted_context = build_prompt(
+                intent,
+                query,
+                retrieved_docs,
+                chat_context,
                 product_context
             )
             
-            # Step 9: Get specialized prompt based on intent
-            specialized_prompt = get_specialized_prompt(intent, formatted_context, query)
-            
             # Step 10: Generate response using specialized agent
-            response = self._call_llm_with_prompt(specialized_prompt)
+            response = self._call_llm_with_prompt(specialized_prompt, on_token)
             
             # Step 11: Process order actions first (if this is an order-taking intent)
             order_processing_result = {"has_order_action": False}
@@ -315,22 +331,19 @@ class RAGSystem:
                     processed_items = order_processing_result.get("items_processed", [])
                     cart_products = []
                     
-                    # Convert processed items to product format
-                    for item in processed_items:
-                        if product_service:
-                            try:
-                                product_details = product_service.get_product_by_id(item["product_id"])
-                                if product_details:
-                                    cart_products.append({
-                                        "id": item["product_id"],
-                                        "name": product_details.get("name", "Unknown Product"),
-                                        "quantity": item.get("quantity", 1),
-                                        "size": item.get("size", ""),
-                                        "price": product_details.get("price", 0),
-                                        "action": order_processing_result.get("action_type", "unknown")
-                                    })
-                            except Exception as e:
-                                logger.error(f"Error getting product details for ID {item['product_id']}: {e}")
+                    if product_service and processed_items:
+                        # Fetch details for all processed items in one query
+                        try:
+                            details_by_id = product_service.get_products_by_ids(
+                                [item["product_id"] for item in processed_items]
+                            )
+                        except Exception as e:
+                            logger.error(f"Error getting product details for cart items: {e}")
+                            details_by_id = None
+                        
+                        # Convert processed items to product format
+                        for item in processed_items:
+                            if details_by_id is None:
                                 # Fallback to basic info
                                 cart_products.append({
                                     "id": item["product_id"],
@@ -339,6 +352,18 @@ class RAGSystem:
                                     "size": item.get("size", ""),
                                     "action": order_processing_result.get("action_type", "unknown")
                                 })
+                                continue
+                            
+                            product_details = details_by_id.get(item["product_id"])
+                            if product_details:
+                                cart_products.append({
+                                    "id": item["product_id"],
+                                    "name": product_details.get("name", "Unknown Product"),
+                                    "quantity": item.get("quantity", 1),
+                                    "size": item.get("size", ""),
+                                    "price": product_details.get("price", 0),
+                                    "action": order_processing_result.get("action_type", "unknown")
+                                })
                     
                     formatted_response = {
                         "products": cart_products,
@@ -355,42 +380,141 @@ class RAGSystem:
                 logger.error(f"Error formatting response with product information: {e}")
                 formatted_response = {"products": [], "metadata": {}}
             
-            # Step 13: Get agent name
-            agent_name = get_agent_name(intent)
-            
             # Return structured response with order processing info
-            return {
-                "response": str(response) if response is not None else "",
-                "intent": str(intent) if intent is not None else "general",
-                "agent": str(agent_name) if agent_name is not None else "BrewMaster Assistant",
-                "sources": retrieved_docs if retrieved_docs is not None else [],
-                "context": str(formatted_context) if formatted_context is not None else "",
-                "products": formatted_response.get("products", []),
-                "metadata": formatted_response.get("metadata", {}),
-                "chat_history_used": use_chat_history,
-                "product_context_used": use_product_resolution,
-                "order_processing": order_processing_result
-            }
+            return RAGResponse(
+                response=response,
+                intent=intent,
+                agent=get_agent_name(intent),
+                sources=retrieved_docs,
+                context=formatted_context,
+                products=formatted_response.get("products", []),
+                metadata=formatted_response.get("metadata", {}),
+                chat_history_used=use_chat_history,
+                product_context_used=use_product_resolution,
+                order_processing=order_processing_result
+            )
         
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             logger.error(f"Error details: {str(e)}")
             import traceback
             logger.error(f"Full traceback: {traceback.format_exc()}")
-            return {
-                "response": f"I apologize, but I'm having trouble processing your request right now. Error: {str(e)[:100]}",
-                "intent": "error",
-                "agent": "System",
-                "sources": [],
-                "context": "",
-                "products": [],
-                "metadata": {},
-                "chat_history_used": False,
-                "product_context_used": False,
-                "order_processing": {"has_order_action": False, "error": str(e)}
+            return RAGResponse(
+                response=f"I apologize, but I'm having trouble processing your request right now. Error: {str(e)[:100]}",
+                intent="error",
+                agent="System",
+                sources=[],
+                context="",
+                products=[],
+                metadata={},
+                chat_history_used=False,
+                product_context_used=False,
+                order_processing={"has_order_action": False, "error": str(e)}
+            )
+    
+    def _handle_cart_management(self, query: str, session_id: str, cart_service, user_id: Optional[int]) -> RAGResponse:
+        """Show the cart with the available cart actions"""
+        intent = "cart_management"
+        cart_summary = order_processor.get_cart_summary(session_id, cart_service, user_id)
+        
+        if cart_summary.get("empty", True):
+            response_text = cart_summary.get("message", "Your cart is empty.")
+        else:
+            response_text = cart_summary["formatted_summary"] + _CART_ACTIONS_TEXT
+        
+        return RAGResponse(
+            response=response_text,
+            intent=intent,
+            agent=get_agent_name(intent),
+            sources=[],
+            context="",
+            products=[],
+            metadata={"cart_action": True, "cart_data": cart_summary},
+            chat_history_used=False,
+            product_context_used=False,
+            order_processing={
+                "has_cart_action": True,
+                "cart_summary": cart_summary
             }
-    def _call_llm_with_prompt(self, prompt: str) -> str:
-        """Call the configured LLM provider with custom prompt"""
+        )
+    
+    def _handle_checkout(self, query: str, session_id: str, cart_service, user_id: Optional[int]) -> RAGResponse:
+        """Start checkout and ask for a payment method"""
+        intent = "checkout"
+        order_service = _get_order_service()
+        
+        checkout_result = order_processor.process_checkout_request(
+            session_id=session_id,
+            cart_service=cart_service,
+            order_service=order_service
+        )
+        
+        return RAGResponse(
+            response=checkout_result.get("message", "") if checkout_result else "",
+            intent=intent,
+            agent=get_agent_name(intent),
+            sources=[],
+            context="",
+            products=[],
+            metadata={"checkout_data": checkout_result.get("data", {}) if checkout_result else {}},
+            chat_history_used=False,
+            product_context_used=False,
+            order_processing={
+                "has_checkout_action": True,
+                "checkout_result": checkout_result
+            }
+        )
+    
+    def _handle_payment_method(self, query: str, session_id: str, cart_service, user_id: Optional[int]) -> RAGResponse:
+        """Complete checkout with the payment method named in the query"""
+        from .llm_utils import extract_payment_method
+        
+        intent = "payment_method"
+        order_service = _get_order_service()
+        payment_method = extract_payment_method(query)
+        
+        checkout_result = order_processor.process_checkout_request(
+            session_id=session_id,
+            payment_method=payment_method,
+            cart_service=cart_service,
+            order_service=order_service
+        )
+        
+        return RAGResponse(
+            response=checkout_result.get("message", "") if checkout_result else "",
+            intent=intent,
+            agent=get_agent_name(intent),
+            sources=[],
+            context="",
+            products=[],
+            metadata={"checkout_data": checkout_result.get("data", {}) if checkout_result else {}},
+            chat_history_used=False,
+            product_context_used=False,
+            order_processing={
+                "has_payment_action": True,
+                "payment_method": payment_method,
+                "checkout_result": checkout_result
+            }
+        )
+    
+    # Intents answered directly by a handler, without retrieval or generation
+    _INTENT_HANDLERS = {
+        "cart_management": _handle_cart_management,
+        "checkout": _handle_checkout,
+        "payment_method": _handle_payment_method,
+    }
+    
+    def _call_llm_with_prompt(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Call the configured LLM provider with custom prompt, streaming to on_token if given"""
+        if on_token is not None:
+            # Order extraction needs the full text, so collect it while streaming
+            parts = []
+            for chunk in stream_llm("", "", provider=self.llm_provider, custom_prompt=prompt):
+                if chunk:
+                    parts.append(chunk)
+                    on_token(chunk)
+            return "".join(parts).strip()
+        
         if self.llm_provider == "local":
             return call_local_llm("", "", custom_prompt=prompt)
         elif self.llm_provider == "openai":
@@ -418,6 +542,12 @@ def create_rag_system(llm_provider: str = "local") -> RAGSystem:
     return RAGSystem(llm_provider=llm_provider)
 
 
+@lru_cache(maxsize=4)
+def _get_rag_system(llm_provider: str) -> RAGSystem:
+    """Return the shared RAG system for a provider, creating it on first use"""
+    return RAGSystem(llm_provider=llm_provider)
+
+
 def quick_rag_query(query: str, llm_provider: str = "local") -> str:
     """
     Quick RAG query without advanced features.
@@ -429,16 +559,16 @@ def quick_rag_query(query: str, llm_provider: str = "local") -> str:
     Returns:
         Response string
     """
-    rag_system = RAGSystem(llm_provider=llm_provider)
+    rag_system = _get_rag_system(llm_provider)
     result = rag_system.generate_response(query)
-    return result["response"]
+    return result.response
 
 
 def advanced_rag_query(
     query: str,
-    chat_history: Optional[List[Dict[str, str]]] = None,
+    chat_history: Optional[List[ChatMsg]] = None,
     llm_provider: str = "local"
-) -> Dict[str, Any]:
+) -> RAGResponse:
     """
     Advanced RAG query with multi-agent system using intelligent context decisions.
     
@@ -448,9 +578,9 @@ def advanced_rag_query(
         llm_provider: LLM provider to use
         
     Returns:
-        Complete response dictionary with agent information
+        Complete RAGResponse with agent information
     """
-    rag_system = RAGSystem(llm_provider=llm_provider)
+    rag_system = _get_rag_system(llm_provider)
     return rag_system.generate_response(
         query,
         chat_history=chat_history
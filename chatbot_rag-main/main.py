@@ -4,19 +4,28 @@ FastAPI application for RAG Chat API with SQLite Database
 """
 
 import sys
+import asyncio
 import os
 from pathlib import Path
 import logging
 import uuid
 import hashlib
+import hmac
 import secrets
-from typing import List, Dict, Any, Optional
+import time
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
 from dotenv import load_dotenv
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import json
+import orjson
 
 # Add the project root to the path
 project_root = Path(__file__).parent.parent
@@ -27,9 +36,11 @@ env_path = Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 # Import RAG system and database services
-from core.rag import advanced_rag_query, RAGSystem
-from core.email_service import EmailService
+from core.rag import advanced_rag_query, RAGSystem, RAGResponse
+from core.llm_utils import ChatMsg
+from core.email_service import get_email_service
 from database.db_service import ProductService, CartService, OrderService, ChatService, UserService
+from database.chat_cache import ChatHistoryCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -42,7 +53,8 @@ cart_service = CartService(db_path)
 order_service = OrderService(db_path)
 chat_service = ChatService(db_path)
 user_service = UserService(db_path)
-email_service = EmailService()
+email_service = get_email_service()
+chat_history_cache = ChatHistoryCache()
 
 # Initialize RAG system
 rag_system = RAGSystem(llm_provider="gemini")
@@ -53,8 +65,17 @@ app = FastAPI(
     title="Coffee RAG API",
     description="API for RAG-based coffee shop assistant with SQLite database",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
+@app.on_event("startup")
+def warm_up_database():
+    """Open a connection at startup so the PRAGMAs (and WAL mode) are applied before the first request"""
+    try:
+        product_service.execute_query("SELECT 1")
+    except Exception as e:
+        logger.error(f"Database warm-up failed: {e}")
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -65,62 +86,117 @@ app.add_middleware(
 )
 
 # Authentication utilities
+# Argon2id, tuned so a single verify stays well under 100 ms
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+
 def hash_password(password: str) -> str:
-    """Hash password using SHA-256 with salt"""
-    salt = secrets.token_hex(16)
-    hash_obj = hashlib.sha256((password + salt).encode())
-    return f"{salt}${hash_obj.hexdigest()}"
+    """Hash password using Argon2id (the salt is embedded in the hash)"""
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    """Verify password against hash"""
+    """Verify password against hash (Argon2id, or legacy salted SHA-256)"""
+    if not hashed_password.startswith("$argon2"):
+        return _verify_legacy_password(password, hashed_password)
     try:
-        salt, hash_value = hashed_password.split('$')
-        hash_obj = hashlib.sha256((password + salt).encode())
-        return hash_obj.hexdigest() == hash_value
-    except:
+        return password_hasher.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
         return False
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check if a stored hash is legacy SHA-256 or uses outdated Argon2 parameters"""
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(hashed_password)
+
+def _verify_legacy_password(password: str, hashed_password: str) -> bool:
+    """Verify password against a legacy salt$sha256 hash"""
+    try:
+        salt, hash_value = hashed_password.split('$', 1)
+    except ValueError:
+        return False
+    digest = hashlib.sha256((password + salt).encode()).hexdigest()
+    # Compare as bytes: compare_digest rejects non-ASCII str
+    return hmac.compare_digest(digest.encode(), hash_value.encode())
+
 def generate_token(user_id: int) -> str:
     """Generate a simple token for demo purposes"""
-    return f"token_{user_id}_{secrets.token_hex(16)}"
+    return f"token_{user_id}_{secrets.token_urlsafe(16)}"
+
+def load_chat_history(session_id: str) -> List[Dict[str, Any]]:
+    """Get a session's chat history, from the cache when possible"""
+    messages = chat_history_cache.get(session_id)
+    if messages is None:
+        messages = chat_service.get_chat_history(session_id)
+        chat_history_cache.set(session_id, messages)
+    return messages
+
+# Guests all share a throwaway password, so hash it once instead of per guest
+_GUEST_PASSWORD_HASH = hash_password('guest_password')
+GUEST_EMAIL_FMT = "guest_{}@temp.com".format
+GUEST_NAME_FMT = "Guest_{:.8}".format
+
+@lru_cache(maxsize=100_000)
+def _guest_user_id(session_id: str) -> int:
+    """Find or create the guest user for a session; raises if creation fails"""
+    return user_service.upsert_guest(
+        GUEST_EMAIL_FMT(session_id),
+        GUEST_NAME_FMT(session_id),
+        _GUEST_PASSWORD_HASH
+    )
 
 def get_or_create_guest_user(session_id: str) -> int:
-    """Get or create a guest user for the session"""
-    # Check if there's already a guest user for this session
-    guest_email = f"guest_{session_id}@temp.com"
-    
-    # Try to find existing guest user
-    existing_users = user_service.execute_query(
-        "SELECT id FROM users WHERE email = ?", 
-        (guest_email,)
-    )
-    
-    if existing_users:
-        return existing_users[0]['id']
-    
-    # Create new guest user
-    guest_user_data = {
-        'name': f'Guest_{session_id[:8]}',
-        'email': guest_email,
-        'password_hash': hash_password('guest_password'),  # Use password_hash instead of password
-        'phone': None
-    }
-    
+    """Get or create a guest user for the session (cached per session)"""
     try:
-        user_id = user_service.create_user(guest_user_data)
-        logger.info(f"Created guest user {user_id} for session {session_id}")
-        return user_id
+        return _guest_user_id(session_id)
     except Exception as e:
         logger.error(f"Error creating guest user: {e}")
         # Fallback to a default guest user ID if creation fails
         return 1  # Assuming user ID 1 exists as a default guest
 
+# Catalog response cache
+# Products and categories change rarely, so their endpoints serve serialized
+# bodies from memory for a short TTL and let clients revalidate with ETag
+CATALOG_CACHE_TTL = 60
+CATALOG_CACHE_MAXSIZE = 1024
+_catalog_cache: Dict[Tuple, Tuple[float, bytes, str]] = {}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header (a list of possibly weak ETags, or *) against etag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def cached_json_response(request: Request, key: Tuple, load: Callable[[], Any]) -> Response:
+    """Serve a cached JSON body for key, loading and caching it on a miss or expiry"""
+    now = time.monotonic()
+    entry = _catalog_cache.get(key)
+    if entry is None or entry[0] <= now:
+        body = orjson.dumps(load())
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if len(_catalog_cache) >= CATALOG_CACHE_MAXSIZE:
+            _catalog_cache.clear()
+        entry = (now + CATALOG_CACHE_TTL, body, etag)
+        _catalog_cache[key] = entry
+    
+    _, body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={CATALOG_CACHE_TTL}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Models
+# Request models ignore unknown fields rather than carrying them around
 class ChatMessage(BaseModel):
     role: str = Field(..., description="Role of the message sender (user or assistant)")
     content: str = Field(..., description="Content of the message")
 
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     session_id: Optional[str] = Field(None, description="Session ID for continuing a conversation")
     message: str = Field(..., description="User message")
     user_id: Optional[int] = Field(None, description="User ID if user is logged in")
@@ -142,6 +218,8 @@ class ChatResponse(BaseModel):
     chat_history: List[ChatMessage] = Field(..., description="Chat history")
 
 class CartItemRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     session_id: str
     user_id: Optional[int] = None
     product_id: int
@@ -150,22 +228,32 @@ class CartItemRequest(BaseModel):
     customizations: Optional[Dict[str, Any]] = None
 
 class LoginRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     email: str
     password: str
 
 class RegisterRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     name: str
     email: str
     password: str
 
 class ForgotPasswordRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     email: str
 
 class ResetPasswordRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     token: str
     new_password: str
 
 class OrderRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    
     session_id: str
     user_id: Optional[int] = None
     total_amount: float
@@ -177,7 +265,73 @@ class OrderRequest(BaseModel):
     billing_address: Optional[Dict[str, Any]] = None
     notes: Optional[str] = None
 
+# Chat helpers
+def open_chat_session(session_id: str) -> List[Dict[str, Any]]:
+    """Create or get a chat session in the database and return its chat history"""
+    chat_service.create_chat_session(session_id)
+    return load_chat_history(session_id)
+
+def prepare_chatbot_turn(request: ChatRequest) -> Tuple[str, int, List[ChatMsg]]:
+    """Resolve the session and user for a chatbot request and load its chat history"""
+    # Get or create session
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    # Use existing user if logged in, otherwise create guest user
+    if request.user_id:
+        user_id = request.user_id
+        logger.info(f"Using existing logged-in user {user_id} for session {session_id}")
+    else:
+        # Get or create guest user for this session
+        user_id = get_or_create_guest_user(session_id)
+        logger.info(f"Using guest user {user_id} for session {session_id}")
+    
+    # Create or get chat session in database
+    chat_service.create_chat_session(session_id, user_id)
+    
+    # Retrieve chat history and convert to format expected by RAG system
+    rag_chat_history = [
+        ChatMsg(msg["role"], msg["content"])
+        for msg in load_chat_history(session_id)
+    ]
+    return session_id, user_id, rag_chat_history
+
+def save_chat_turn(session_id: str, message: str, result: RAGResponse) -> None:
+    """Save the user message and reply, keeping the history cache in step"""
+    try:
+        # Save both messages and the session timestamp in one transaction
+        # (RAGResponse fields are already strings)
+        chat_service.record_turn(session_id, message, result.response, result.intent, result.agent)
+        chat_history_cache.append(
+            session_id,
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": result.response}
+        )
+    except Exception as e:
+        logger.error(f"Error saving chat turn to database: {str(e)}")
+        # Continue processing even if database insert fails
+
+def chatbot_response_data(session_id: str, result: RAGResponse) -> Dict[str, Any]:
+    """Build the /api/chatbot response body for a RAG result"""
+    response_data = {
+        "reply": result.response,
+        "session_id": session_id,
+        "intent": result.intent,
+        "agent": result.agent,
+        "products": result.products  # Include products in response
+    }
+    
+    # Add order processing info if available
+    if result.order_processing.get("has_order_action"):
+        response_data["order_processing"] = result.order_processing
+    return response_data
+
+def sse_event(event: str, data: Any) -> bytes:
+    """Encode one Server-Sent Event with a JSON payload"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
 # Routes
+# Endpoints that only do blocking SQLite work are plain functions, so FastAPI
+# runs them in its threadpool instead of on the event loop
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -202,24 +356,20 @@ async def chat_endpoint(request: ChatRequest):
         # Get or create session
         session_id = request.session_id or str(uuid.uuid4())
         
-        # Create or get chat session in database
-        chat_service.create_chat_session(session_id)
-        
-        # Retrieve chat history from database
-        db_messages = chat_service.get_chat_history(session_id)
+        # Create or get chat session and retrieve its history, off the event loop
+        db_messages = await run_in_threadpool(open_chat_session, session_id)
         
         # Convert to format expected by RAG system
         rag_chat_history = [
-            {"role": msg["role"], "content": msg["content"]}
+            ChatMsg(msg["role"], msg["content"])
             for msg in db_messages
         ]
         
-        # Add user message to database
-        chat_service.add_chat_message(session_id, "user", request.message)
-        
         # Call RAG system with chat history and order processing capabilities
         logger.info(f"Processing query: '{request.message[:50]}...' for session {session_id}")
-        result = rag_system.generate_response(
+        # generate_response blocks (retrieval + LLM call), so keep it off the event loop
+        result = await run_in_threadpool(
+            rag_system.generate_response,
             query=request.message,
             chat_history=rag_chat_history,
             session_id=session_id,
@@ -227,56 +377,32 @@ async def chat_endpoint(request: ChatRequest):
             product_service=product_service
         )
         
-        # Add assistant response to database
-        try:
-            # Ensure the result is properly formatted and values are strings
-            response = result.get("response", "")
-            products = result.get("products", [])
-            print(f"response from RAG system: {response[:100]}...")
-            print(f"products found: {len(products)} - {[p.get('name', 'Unknown') for p in products[:3]]}")
-            intent = result.get("intent", "general")
-            agent = result.get("agent", "BrewMaster Assistant")
-            
-            # Convert to strings if they aren't already
-            response = str(response) if response is not None else ""
-            intent = str(intent) if intent is not None else "general"
-            agent = str(agent) if agent is not None else "BrewMaster Assistant"
-            
-            chat_service.add_chat_message(
-                session_id, 
-                "assistant", 
-                response,
-                intent,
-                agent
-            )
-        except Exception as e:
-            logger.error(f"Error adding assistant message to database: {str(e)}")
-            # Continue processing even if database insert fails
+        logger.debug("Response from RAG system: %.100s... (%d products)", result.response, len(result.products))
         
-        # Update session timestamp
-        chat_service.update_session_timestamp(session_id)
+        # Add the turn to the database
+        await run_in_threadpool(save_chat_turn, session_id, request.message, result)
         
-        # Convert database messages to response format
+        # Convert database messages to response format (trusted rows, so skip validation)
         chat_history = [
-            ChatMessage(role=msg["role"], content=msg["content"])
+            ChatMessage.model_construct(role=msg["role"], content=msg["content"])
             for msg in db_messages
         ]
         
-        # Add current messages
-        chat_history.append(ChatMessage(role="user", content=request.message))
-        chat_history.append(ChatMessage(role="assistant", content=result["response"]))
+        # Add current messages (already validated strings)
+        chat_history.append(ChatMessage.model_construct(role="user", content=request.message))
+        chat_history.append(ChatMessage.model_construct(role="assistant", content=result.response))
         
         # Return structured response with order processing info
-        response_products = result.get("products", [])
+        response_products = result.products
         logger.info(f"Returning {len(response_products)} products to frontend")
         
         return ChatResponse(
             session_id=session_id,
-            response=result["response"],
-            intent=result.get("intent", "unknown"),
-            agent=result.get("agent", "Assistant"),
+            response=result.response,
+            intent=result.intent,
+            agent=result.agent,
             products=response_products,
-            sources_count=len(result.get("sources", [])),
+            sources_count=len(result.sources),
             chat_history=chat_history
         )
     except Exception as e:
@@ -291,35 +417,11 @@ async def chatbot_endpoint(request: ChatRequest):
     try:
         logger.info(f"Chatbot request received - session_id: {request.session_id}, user_id: {request.user_id}, message: {request.message[:50]}...")
         
-        # Get or create session
-        session_id = request.session_id or str(uuid.uuid4())
-        
-        # Use existing user if logged in, otherwise create guest user
-        if request.user_id:
-            user_id = request.user_id
-            logger.info(f"Using existing logged-in user {user_id} for session {session_id}")
-        else:
-            # Get or create guest user for this session
-            user_id = get_or_create_guest_user(session_id)
-            logger.info(f"Using guest user {user_id} for session {session_id}")
-        
-        # Create or get chat session in database
-        chat_service.create_chat_session(session_id, user_id)
-        
-        # Retrieve chat history from database
-        db_messages = chat_service.get_chat_history(session_id)
+        session_id, user_id, rag_chat_history = await run_in_threadpool(prepare_chatbot_turn, request)
         
-        # Convert to format expected by RAG system
-        rag_chat_history = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in db_messages
-        ]
-        
-        # Add user message to database
-        chat_service.add_chat_message(session_id, "user", request.message)
-        
-        # Call RAG system with order processing capabilities and user
-        result = rag_system.generate_response(
+        # Call RAG system with order processing capabilities and user, off the event loop
+        result = await run_in_threadpool(
+            rag_system.generate_response,
             query=request.message,
             chat_history=rag_chat_history,
             session_id=session_id,
@@ -328,45 +430,11 @@ async def chatbot_endpoint(request: ChatRequest):
             user_id=user_id  # Pass the user ID (either logged-in or guest)
         )
         
-        # Add assistant response to database
-        try:
-            # Ensure the result is properly formatted and values are strings
-            response = result.get("response", "")
-            intent = result.get("intent", "general")
-            agent = result.get("agent", "BrewMaster Assistant")
-            
-            # Convert to strings if they aren't already
-            response = str(response) if response is not None else ""
-            intent = str(intent) if intent is not None else "general"
-            agent = str(agent) if agent is not None else "BrewMaster Assistant"
-            
-            chat_service.add_chat_message(
-                session_id, 
-                "assistant", 
-                response,
-                intent,
-                agent
-            )
-        except Exception as e:
-            logger.error(f"Error adding assistant message to database: {str(e)}")
-            # Continue processing even if database insert fails
-        
-        # Update session timestamp
-        chat_service.update_session_timestamp(session_id)
+        # Add the turn to the database
+        await run_in_threadpool(save_chat_turn, session_id, request.message, result)
         
         # Return simplified response for frontend with order processing info
-        response_data = {
-            "reply": result["response"],
-            "session_id": session_id,
-            "intent": result.get("intent", "unknown"),
-            "agent": result.get("agent", "Assistant"),
-            "products": result.get("products", [])  # Include products in response
-        }
-        
-        # Add order processing info if available
-        if "order_processing" in result and result["order_processing"].get("has_order_action"):
-            response_data["order_processing"] = result["order_processing"]
-            
+        response_data = chatbot_response_data(session_id, result)
         logger.info(f"Chatbot endpoint returning {len(response_data.get('products', []))} products")
         return response_data
         
@@ -374,36 +442,86 @@ async def chatbot_endpoint(request: ChatRequest):
         logger.error(f"Error processing chatbot request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/api/chatbot/stream")
+async def chatbot_stream_endpoint(request: ChatRequest):
+    """
+    Streaming chatbot endpoint (preferred over /api/chatbot for new clients)
+    
+    - Sends Server-Sent Events: a "token" event for each LLM text chunk as it is generated
+    - Ends with a "done" event carrying the same body /api/chatbot returns; its reply is
+      authoritative, since cart actions can replace the streamed text
+    - Saves the turn to the database before the "done" event
+    """
+    try:
+        logger.info(f"Streaming chatbot request received - session_id: {request.session_id}, user_id: {request.user_id}")
+        session_id, user_id, rag_chat_history = await run_in_threadpool(prepare_chatbot_turn, request)
+    except Exception as e:
+        logger.error(f"Error preparing streaming chatbot request: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    
+    loop = asyncio.get_running_loop()
+    tokens: asyncio.Queue = asyncio.Queue()
+    
+    def on_token(chunk: str) -> None:
+        # Called from the worker thread running generate_response
+        loop.call_soon_threadsafe(tokens.put_nowait, chunk)
+    
+    def generate_and_save() -> RAGResponse:
+        # Save in the worker thread, so the turn is recorded (alongside any
+        # cart change) even if the client disconnects and the stream is closed
+        result = rag_system.generate_response(
+            query=request.message,
+            chat_history=rag_chat_history,
+            session_id=session_id,
+            cart_service=cart_service,
+            product_service=product_service,
+            user_id=user_id,
+            on_token=on_token
+        )
+        save_chat_turn(session_id, request.message, result)
+        return result
+    
+    async def events():
+        generation = asyncio.ensure_future(run_in_threadpool(generate_and_save))
+        # Queued after any tokens the worker scheduled before returning
+        generation.add_done_callback(lambda _: tokens.put_nowait(None))
+        
+        while (chunk := await tokens.get()) is not None:
+            yield sse_event("token", chunk)
+        
+        try:
+            result = generation.result()
+        except Exception as e:
+            logger.error(f"Error processing streaming chatbot request: {str(e)}")
+            yield sse_event("error", {"detail": "Error processing request"})
+            return
+        
+        yield sse_event("done", chatbot_response_data(session_id, result))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/chat/history/{session_id}")
-async def get_chat_history(session_id: str, limit: int = Query(50, ge=1, le=100)):
+def get_chat_history(session_id: str, limit: int = Query(50, ge=1, le=100)):
     """
     Get chat history for a specific session
     """
     try:
         logger.info(f"Fetching chat history for session: {session_id}, limit: {limit}")
         
-        # Get chat history from database
-        db_messages = chat_service.get_chat_history(session_id, limit)
-        
-        # Convert to frontend format
-        chat_history = []
-        for msg in db_messages:
-            chat_history.append({
-                "id": str(msg.get("id", "")),
-                "text": msg.get("content", ""),
-                "isBot": msg.get("role", "") == "assistant",
-                "timestamp": msg.get("created_at", ""),
-                "role": msg.get("role", ""),
-                "intent": msg.get("intent", ""),
-                "agent": msg.get("agent", "")
-            })
+        # Get chat history from database, already in frontend format
+        chat_history = chat_service.get_chat_history_for_display(session_id, limit)
         
         logger.info(f"Returning {len(chat_history)} messages for session {session_id}")
-        return {
+        # Plain dicts, so serialize them directly instead of via jsonable_encoder
+        return ORJSONResponse(content={
             "session_id": session_id,
             "messages": chat_history,
             "total_messages": len(chat_history)
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error fetching chat history: {str(e)}")
@@ -411,7 +529,8 @@ async def get_chat_history(session_id: str, limit: int = Query(50, ge=1, le=100)
 
 # Product endpoints
 @app.get("/api/v1/products/")
-async def get_products(
+def get_products(
+    request: Request,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
     category_id: Optional[int] = None,
@@ -421,20 +540,34 @@ async def get_products(
 ):
     """Get products with filtering and pagination"""
     try:
-        return product_service.get_products(
-            skip=skip,
-            limit=limit,
-            category_id=category_id,
-            is_popular=is_popular,
-            is_active=is_active,
-            search=search
+        return cached_json_response(
+            request,
+            ("products", skip, limit, category_id, is_popular, is_active, search),
+            lambda: product_service.get_products(
+                skip=skip,
+                limit=limit,
+                category_id=category_id,
+                is_popular=is_popular,
+                is_active=is_active,
+                search=search
+            )
         )
     except Exception as e:
         logger.error(f"Error getting products: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving products")
 
+@app.get("/api/v1/products/by-ids/")
+def get_products_by_ids(ids: List[int] = Query(..., max_length=100)):
+    """Get several products by ID in one query, in the requested order"""
+    try:
+        products = product_service.get_products_by_ids(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
+    except Exception as e:
+        logger.error(f"Error getting products {ids}: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving products")
+
 @app.get("/api/v1/products/{product_id}")
-async def get_product(product_id: int):
+def get_product(product_id: int):
     """Get a specific product by ID"""
     try:
         product = product_service.get_product_by_id(product_id)
@@ -449,7 +582,7 @@ async def get_product(product_id: int):
 
 # Cart endpoints
 @app.post("/api/v1/cart/")
-async def add_to_cart(request: CartItemRequest):
+def add_to_cart(request: CartItemRequest):
     """Add item to cart"""
     try:
         return cart_service.add_to_cart(
@@ -467,7 +600,7 @@ async def add_to_cart(request: CartItemRequest):
         raise HTTPException(status_code=500, detail="Error adding item to cart")
 
 @app.get("/api/v1/cart/")
-async def get_cart(
+def get_cart(
     session_id: str = Query(...),
     user_id: Optional[int] = None
 ):
@@ -479,7 +612,7 @@ async def get_cart(
         raise HTTPException(status_code=500, detail="Error retrieving cart")
 
 @app.put("/api/v1/cart/{cart_item_id}")
-async def update_cart_item(cart_item_id: int, quantity: int):
+def update_cart_item(cart_item_id: int, quantity: int):
     """Update cart item quantity"""
     try:
         success = cart_service.update_cart_item_quantity(cart_item_id, quantity)
@@ -493,7 +626,7 @@ async def update_cart_item(cart_item_id: int, quantity: int):
         raise HTTPException(status_code=500, detail="Error updating cart item")
 
 @app.delete("/api/v1/cart/{cart_item_id}")
-async def remove_from_cart(cart_item_id: int):
+def remove_from_cart(cart_item_id: int):
     """Remove item from cart"""
     try:
         success = cart_service.remove_from_cart(cart_item_id)
@@ -507,7 +640,7 @@ async def remove_from_cart(cart_item_id: int):
         raise HTTPException(status_code=500, detail="Error removing item from cart")
 
 @app.delete("/api/v1/cart/")
-async def clear_cart(
+def clear_cart(
     session_id: str = Query(...),
     user_id: Optional[int] = None
 ):
@@ -521,7 +654,7 @@ async def clear_cart(
 
 # Session endpoint
 @app.get("/api/v1/session-id/")
-async def generate_session_id():
+def generate_session_id():
     """Generate a new session ID"""
     session_id = str(uuid.uuid4())
     # Create session in database
@@ -530,7 +663,7 @@ async def generate_session_id():
 
 # Auth endpoints
 @app.post("/api/v1/login")
-async def login(request: LoginRequest):
+def login(request: LoginRequest):
     """User login endpoint"""
     try:
         user = user_service.get_user_by_email(request.email)
@@ -540,6 +673,10 @@ async def login(request: LoginRequest):
         if not verify_password(request.password, user["password_hash"]):
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
+        # Upgrade legacy SHA-256 hashes (and old Argon2 parameters) on login
+        if password_needs_rehash(user["password_hash"]):
+            user_service.update_user_password(user["id"], hash_password(request.password))
+        
         token = generate_token(user["id"])
         return {
             "access_token": token,
@@ -551,7 +688,7 @@ async def login(request: LoginRequest):
         raise HTTPException(status_code=500, detail="Error during login")
 
 @app.post("/api/v1/register")
-async def register(request: RegisterRequest):
+def register(request: RegisterRequest):
     """User registration endpoint"""
     try:
         if user_service.get_user_by_email(request.email):
@@ -574,8 +711,8 @@ async def register(request: RegisterRequest):
         logger.error(f"Error during registration: {e}")
         raise HTTPException(status_code=500, detail="Error during registration")
 
-@app.post("/api/v1/forgot-password")
-async def forgot_password(request: ForgotPasswordRequest):
+@app.post("/api/v1/forgot-password", status_code=202)
+def forgot_password(request: ForgotPasswordRequest):
     """Forgot password endpoint - sends reset email"""
     try:
         # Check if user exists
@@ -593,18 +730,15 @@ async def forgot_password(request: ForgotPasswordRequest):
         if not success:
             raise HTTPException(status_code=500, detail="Error creating reset token")
         
-        # Send reset email
+        # Queue reset email; send failures are logged by the email service
+        # and never fail the request
         user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-        email_sent = email_service.send_password_reset_email(
+        email_service.send_password_reset_email_async(
             recipient_email=request.email,
             reset_token=reset_token,
             user_name=user_name or None
         )
         
-        if not email_sent:
-            logger.error(f"Failed to send password reset email to {request.email}")
-            # Don't fail the request even if email fails to send
-        
         return {"message": "If the email exists, a password reset link has been sent"}
         
     except HTTPException:
@@ -614,7 +748,7 @@ async def forgot_password(request: ForgotPasswordRequest):
         raise HTTPException(status_code=500, detail="Error processing forgot password request")
 
 @app.post("/api/v1/reset-password")
-async def reset_password(request: ResetPasswordRequest):
+def reset_password(request: ResetPasswordRequest):
     """Reset password endpoint - resets password with token"""
     try:
         # Validate token
@@ -633,8 +767,8 @@ async def reset_password(request: ResetPasswordRequest):
         # Mark token as used
         user_service.use_password_reset_token(request.token)
         
-        # Send confirmation email
-        email_service.send_password_reset_confirmation_email(
+        # Queue confirmation email
+        email_service.send_password_reset_confirmation_email_async(
             recipient_email=token_data["email"],
             user_name=None  # We could get user name from database if needed
         )
@@ -649,7 +783,7 @@ async def reset_password(request: ResetPasswordRequest):
 
 # Order endpoints
 @app.post("/api/v1/orders/")
-async def create_order(request: OrderRequest):
+def create_order(request: OrderRequest):
     """Create a new order"""
     try:
         # Get cart items for the session
@@ -695,7 +829,7 @@ async def create_order(request: OrderRequest):
         raise HTTPException(status_code=500, detail="Error creating order")
 
 @app.get("/api/v1/orders/")
-async def get_orders(user_id: Optional[int] = None):
+def get_orders(user_id: Optional[int] = None):
     """Get orders for a user"""
     try:
         return order_service.get_orders(user_id)
@@ -704,7 +838,7 @@ async def get_orders(user_id: Optional[int] = None):
         raise HTTPException(status_code=500, detail="Error retrieving orders")
 
 @app.get("/api/v1/orders/{order_id}")
-async def get_order(order_id: int):
+def get_order(order_id: int):
     """Get specific order by ID"""
     try:
         order = order_service.get_order_by_id(order_id)
@@ -719,10 +853,10 @@ async def get_order(order_id: int):
 
 # Categories endpoint
 @app.get("/api/v1/categories/")
-async def get_categories():
+def get_categories(request: Request):
     """Get all categories"""
     try:
-        return product_service.get_categories()
+        return cached_json_response(request, ("categories",), product_service.get_categories)
     except Exception as e:
         logger.error(f"Error getting categories: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving categories")
@@ -737,6 +871,13 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
+    # Auto-reload only for development (DEV=1); it runs a file watcher and
+    # can't be combined with multiple workers. Each worker loads its own RAG
+    # system and opens its own database connections.
+    reload = os.getenv("DEV") == "1"
+    workers = 1 if reload else int(os.getenv("WORKERS", "1"))
+    
     print(f"Starting server on {args.host}:{args.port}")
     print(f"Database: {db_path}")
-    uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+    # loop/http default to "auto", which picks uvloop and httptools when installed
+    uvicorn.run("main:app", host=args.host, port=args.port, reload=reload, workers=workers)
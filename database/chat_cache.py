@@ -0,0 +1,87 @@
+"""
+Chat History Cache
+Keeps each session's chat history in Redis so chat turns don't re-read it from SQLite
+"""
+
+import os
+import json
+import logging
+from typing import List, Dict, Optional
+
+try:
+    import redis  # optional; without it (or REDIS_URL) the cache is disabled
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+class ChatHistoryCache:
+    """Redis list of {role, content} messages per session, mirroring chat_messages"""
+
+    def __init__(self, url: Optional[str] = None, ttl: int = 3600):
+        self.ttl = ttl
+        self.client = None
+
+        url = url or os.getenv("REDIS_URL")
+        if url and redis is not None:
+            self.client = redis.Redis.from_url(url, decode_responses=True)
+        elif url:
+            logger.warning("REDIS_URL is set but redis is not installed; chat history cache disabled")
+
+    def _key(self, session_id: str) -> str:
+        return f"chat:{session_id}"
+
+    def get(self, session_id: str, limit: int = 50) -> Optional[List[Dict]]:
+        """Get the first `limit` messages (like ChatService.get_chat_history), or None on a miss"""
+        if self.client is None:
+            return None
+        try:
+            raw = self.client.lrange(self._key(session_id), 0, limit - 1)
+        except Exception as e:
+            logger.warning(f"Chat history cache read failed: {e}")
+            return None
+        if not raw:
+            return None
+        return [json.loads(message) for message in raw]
+
+    def set(self, session_id: str, messages: List[Dict]) -> None:
+        """Replace the cached history for a session"""
+        if self.client is None or not messages:
+            return
+        key = self._key(session_id)
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(key)
+            pipe.rpush(key, *[self._dump(message) for message in messages])
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Chat history cache write failed: {e}")
+
+    def append(self, session_id: str, *messages: Dict) -> None:
+        """Append messages if the session is cached; a miss is left to the next read"""
+        if self.client is None:
+            return
+        key = self._key(session_id)
+        try:
+            pipe = self.client.pipeline()
+            pipe.rpushx(key, *[self._dump(message) for message in messages])
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Chat history cache write failed: {e}")
+            # Drop the entry rather than leave it missing a message
+            self.invalidate(session_id)
+
+    def invalidate(self, session_id: str) -> None:
+        """Drop the cached history for a session"""
+        if self.client is None:
+            return
+        try:
+            self.client.delete(self._key(session_id))
+        except Exception as e:
+            logger.warning(f"Chat history cache delete failed: {e}")
+
+    @staticmethod
+    def _dump(message: Dict) -> str:
+        return json.dumps({"role": message["role"], "content": message["content"]})
@@ -6,6 +6,7 @@ Handles all database operations for the coffee shop application
 
 import sqlite3
 import json
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
@@ -13,23 +14,41 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Applied to every new connection. WAL lets readers run alongside the writer,
+# and the larger page cache and mmap keep hot rows out of read() calls
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",  # 256 MiB
+    "PRAGMA cache_size = -65536",  # 64 MiB
+    "PRAGMA busy_timeout = 5000",
+)
+
 class DatabaseService:
     def __init__(self, db_path: str = "database/coffee_shop.db"):
         self.db_path = db_path
-        self.conn = None
+        # sqlite3 connections can't be shared across threads, so each
+        # threadpool worker keeps its own
+        self._local = threading.local()
         
     def get_connection(self):
-        """Get database connection"""
-        if self.conn is None:
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row  # Enable dict-like access
-        return self.conn
+        """Get this thread's database connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row  # Enable dict-like access
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
         
     def close_connection(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        """Close this thread's database connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn:
+            conn.close()
+            self._local.conn = None
             
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
         """Execute a SELECT query and return results as list of dicts"""
@@ -157,23 +176,7 @@ LIMIT ? OFFSET ?
         
         # Process products
         for product in products:
-            # Parse JSON fields
-            if product.get('nutrition_info'):
-                try:
-                    product['nutrition_info'] = json.loads(product['nutrition_info'])
-                except:
-                    product['nutrition_info'] = {}
-                    
-            # Add category object
-            product['category'] = {
-                'id': product['category_id'],
-                'name': product['category_name'],
-                'description': product['category_description']
-            }
-            
-            # Remove redundant fields
-            for field in ['category_name', 'category_description', 'product_type_name', 'product_group_name']:
-                product.pop(field, None)
+            self._process_product_row(product)
                 
         return {
             'products': products,
@@ -182,6 +185,66 @@ LIMIT ? OFFSET ?
             'per_page': limit
         }
         
+    def get_products_bulk(self, names: List[str], limit: int = 5) -> Dict[str, List[Dict]]:
+        """Search products for several names in one query, keyed by name"""
+        if not names:
+            return {}
+        
+        where_clause = " OR ".join(["(p.name LIKE ? OR p.description LIKE ?)"] * len(names))
+        params = []
+        for name in names:
+            search_term = f"%{name}%"
+            params.extend([search_term, search_term])
+        
+        query = f"""
+SELECT
+    p.*,
+    c.name as category_name,
+    c.description as category_description,
+    pt.name as product_type_name,
+    pg.name as product_group_name
+FROM products p
+LEFT JOIN categories c ON p.category_id = c.id
+LEFT JOIN product_types pt ON p.product_type_id = pt.id
+LEFT JOIN product_groups pg ON p.product_group_id = pg.id
+WHERE {where_clause}
+ORDER BY p.is_popular DESC, p.retail_price DESC
+"""
+        products = self.execute_query(query, params)
+        for product in products:
+            self._process_product_row(product)
+        
+        # Same rows, in the same order, that get_products(search=name) would return
+        results = {}
+        for name in names:
+            name_lower = name.lower()
+            results[name] = [
+                product for product in products
+                if name_lower in (product.get('name') or '').lower()
+                or name_lower in (product.get('description') or '').lower()
+            ][:limit]
+        return results
+        
+    def _process_product_row(self, product: Dict) -> None:
+        """Parse JSON fields and nest category details of a product row"""
+        # Parse JSON fields
+        if product.get('nutrition_info'):
+            try:
+                product['nutrition_info'] = json.loads(product['nutrition_info'])
+            except:
+                product['nutrition_info'] = {}
+                
+        # Add category object
+        product['category'] = {
+            'id': product['category_id'],
+            'name': product['category_name'],
+            'description': product['category_description']
+        }
+        
+        # Remove redundant fields
+        for field in ['category_name', 'category_description', 'product_type_name', 'product_group_name']:
+            product.pop(field, None)
+        
     def get_product_by_id(self, product_id: int) -> Optional[Dict]:
         """Get a single product by ID"""
         query = """
@@ -203,26 +266,43 @@ LIMIT ? OFFSET ?
             return None
             
         product = results[0]
+        self._process_product_row(product)
+        return product
         
-        # Parse JSON fields
-        if product.get('nutrition_info'):
-            try:
-                product['nutrition_info'] = json.loads(product['nutrition_info'])
-            except:
-                product['nutrition_info'] = {}
-                
-        # Add category object
-        product['category'] = {
-            'id': product['category_id'],
-            'name': product['category_name'],
-            'description': product['category_description']
-        }
+    def get_products_by_ids(self, product_ids: List[int]) -> Dict[int, Dict]:
+        """Get several products by ID in one query, keyed by the requested ID"""
+        if not product_ids:
+            return {}
         
-        # Remove redundant fields
-        for field in ['category_name', 'category_description', 'product_type_name', 'product_group_name']:
-            product.pop(field, None)
-            
-        return product
+        ids = list(dict.fromkeys(product_ids))
+        placeholders = ", ".join(["?"] * len(ids))
+        query = f"""
+            SELECT
+                p.*,
+                c.name as category_name,
+                c.description as category_description,
+                pt.name as product_type_name,
+                pg.name as product_group_name
+            FROM products p
+            LEFT JOIN categories c ON p.category_id = c.id
+            LEFT JOIN product_types pt ON p.product_type_id = pt.id
+            LEFT JOIN product_groups pg ON p.product_group_id = pg.id
+            WHERE p.id IN ({placeholders}) OR p.product_id IN ({placeholders})
+        """
+        
+        products = self.execute_query(query, tuple(ids) * 2)
+        for product in products:
+            self._process_product_row(product)
+        
+        # Like get_product_by_id, a match on id wins over a match on product_id
+        by_id = {product['id']: product for product in products}
+        by_product_id = {product['product_id']: product for product in products}
+        results = {}
+        for product_id in ids:
+            product = by_id.get(product_id) or by_product_id.get(product_id)
+            if product:
+                results[product_id] = product
+        return results
         
     def get_categories(self) -> List[Dict]:
         """Get all categories"""
@@ -291,19 +371,57 @@ class CartService(DatabaseService):
                    user_id: Optional[int] = None, selected_size: Optional[str] = None,
                    customizations: Optional[Dict] = None) -> Dict:
         """Add item to cart with proper cart architecture"""
+        return self.bulk_add_to_cart(session_id, [{
+            'product_id': product_id,
+            'quantity': quantity,
+            'selected_size': selected_size,
+            'customizations': customizations
+        }], user_id)
+    
+    def bulk_add_to_cart(self, session_id: str, items: List[Dict[str, Any]],
+                         user_id: Optional[int] = None) -> Dict:
+        """Add several items (product_id, quantity, selected_size, customizations) to the cart in one transaction"""
         if not user_id:
             raise ValueError("User ID is required for cart operations")
-            
-        # Get product details
-        product_service = ProductService(self.db_path)
-        product = product_service.get_product_by_id(product_id)
-        if not product:
-            raise ValueError(f"Product with ID {product_id} not found")
+        
+        # Get product details in one query
+        products_by_id = ProductService(self.db_path).get_products_by_ids(
+            [item['product_id'] for item in items]
+        )
+        products = []
+        for item in items:
+            product = products_by_id.get(item['product_id'])
+            if not product:
+                raise ValueError(f"Product with ID {item['product_id']} not found")
+            products.append(product)
         
         # Get or create cart
         cart = self.get_or_create_cart(user_id, session_id)
         cart_id = cart['id']
         
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            for item, product in zip(items, products):
+                self._add_cart_item(
+                    cursor, cart_id, product, item.get('quantity', 1),
+                    item.get('selected_size'), item.get('customizations')
+                )
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Database update error: {e}")
+            conn.rollback()
+            raise
+        
+        # Update cart totals
+        self.update_cart_totals(cart_id)
+        
+        # Return updated cart
+        return self.get_cart(session_id, user_id)
+    
+    def _add_cart_item(self, cursor, cart_id: int, product: Dict, quantity: int,
+                       selected_size: Optional[str], customizations: Optional[Dict]) -> None:
+        """Insert a cart item or add to the quantity of a matching one, without committing"""
         # Use the database primary key for cart operations
         db_product_id = product['id']
         unit_price = float(product['retail_price'])
@@ -323,19 +441,18 @@ class CartService(DatabaseService):
                       (customizations = ?)
                   )
         """
-        params_check = [cart_id, db_product_id, selected_size, selected_size, customizations_json, customizations_json]
-        existing = self.execute_query(query_check, tuple(params_check))
+        params_check = (cart_id, db_product_id, selected_size, selected_size, customizations_json, customizations_json)
+        existing = cursor.execute(query_check, params_check).fetchone()
         
         if existing:
             # Update existing item
-            cart_item_id = existing[0]['id']
-            new_quantity = existing[0]['quantity'] + quantity
+            new_quantity = existing['quantity'] + quantity
             update_query = """
                 UPDATE cart_items
                 SET quantity = ?, total_price = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             """
-            self.execute_update(update_query, (new_quantity, unit_price * new_quantity, cart_item_id))
+            cursor.execute(update_query, (new_quantity, unit_price * new_quantity, existing['id']))
         else:
             # Add new item
             query = """
@@ -344,16 +461,10 @@ class CartService(DatabaseService):
                     customizations, unit_price, total_price, created_at, updated_at
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
             """
-            self.execute_update(query, (
+            cursor.execute(query, (
                 cart_id, db_product_id, quantity, selected_size,
                 customizations_json, unit_price, total_price
             ))
-        
-        # Update cart totals
-        self.update_cart_totals(cart_id)
-        
-        # Return updated cart
-        return self.get_cart(session_id, user_id)
 
     def get_cart(self, session_id: str = None, user_id: Optional[int] = None) -> Dict[str, Any]:
         """Get cart items for a user with proper cart architecture"""
@@ -731,12 +842,54 @@ class ChatService(DatabaseService):
         query = """
             SELECT * FROM chat_messages 
             WHERE session_id = ?
-            ORDER BY created_at ASC
+            ORDER BY created_at ASC, id ASC
             LIMIT ?
         """
         
         return self.execute_query(query, (session_id, limit))
         
+    def get_chat_history_for_display(self, session_id: str, limit: int = 50) -> List[Dict]:
+        """Get chat history for a session with columns named as the frontend expects"""
+        query = """
+            SELECT CAST(id AS TEXT) AS id, content AS text, role = 'assistant' AS isBot,
+                   created_at AS timestamp, role, intent, agent
+            FROM chat_messages 
+            WHERE session_id = ?
+            ORDER BY created_at ASC, id ASC
+            LIMIT ?
+        """
+        
+        messages = self.execute_query(query, (session_id, limit))
+        for message in messages:
+            # SQLite returns the comparison as 0/1
+            message["isBot"] = bool(message["isBot"])
+        return messages
+        
+    def record_turn(self, session_id: str, user_message: str, assistant_message: str,
+                    intent: Optional[str] = None, agent: Optional[str] = None) -> None:
+        """Save a user message, the assistant reply and the session timestamp in one transaction"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO chat_messages (
+                    session_id, role, content, intent, agent, created_at
+                ) VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, [
+                (session_id, "user", user_message, None, None),
+                (session_id, "assistant", assistant_message, intent, agent)
+            ])
+            cursor.execute("""
+                UPDATE chat_sessions 
+                SET updated_at = CURRENT_TIMESTAMP
+                WHERE session_id = ?
+            """, (session_id,))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording chat turn: {e}")
+            conn.rollback()
+            raise
+        
     def update_session_timestamp(self, session_id: str) -> None:
         """Update session timestamp"""
         query = """
@@ -791,6 +944,33 @@ class UserService(DatabaseService):
             logger.error(f"Error creating user: {e}")
             raise
         
+    def upsert_guest(self, email: str, name: str, password_hash: str) -> int:
+        """Create a guest user, or find the existing one with this email, and return its ID"""
+        first_name, _, last_name = name.partition(' ')
+        
+        # The no-op update makes RETURNING yield the existing row on conflict,
+        # so lookup and insert are one statement with no race between them
+        query = """
+            INSERT INTO users (
+                email, password_hash, first_name, last_name,
+                is_active, is_admin, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, 1, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT(email) DO UPDATE SET email = excluded.email
+            RETURNING id
+        """
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, (email, password_hash, first_name, last_name))
+            user_id = cursor.fetchone()[0]
+            conn.commit()
+            return user_id
+        except Exception as e:
+            logger.error(f"Error upserting guest user: {e}")
+            conn.rollback()
+            raise
+        
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
         query = """